@@ -41,6 +41,15 @@ setup(
         'sendgrid~=6.11',
     ],
     extras_require={
+        'isal': [
+            'isal~=1.7',
+        ],
+        'pybase64': [
+            'pybase64~=1.4',
+        ],
+        'zstd': [
+            'zstandard~=0.15',
+        ],
         'tests': [
             'pylint-quotes~=0.2',
             'pylint>=2.17,<4.0',
@@ -50,6 +59,7 @@ setup(
             'pytest-mock~=3.11',
             # 'pytest-pylint~=0.19',  #: Causes pytest to fail
             'pytest-watch~=4.2',
+            'pytest-xdist~=3.3',
             'pytest>=7.4,<9.0',
             'yapf~=0.40',
         ]
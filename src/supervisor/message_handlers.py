@@ -2,23 +2,252 @@
 message_handlers.py: Holds all the different message handlers
 """
 
-import gzip
+import asyncio
 import io
+import mimetypes
+import mmap
+import os
+import sys
+import tarfile
+import threading
+import time
 import warnings
 from abc import ABC, abstractmethod
-from base64 import b64encode
-from email.mime.application import MIMEApplication
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage, MIMEPart
+from functools import lru_cache
 from pathlib import Path
-from shutil import make_archive
+from shutil import copyfileobj
 from smtplib import SMTP
-from tempfile import TemporaryDirectory
-from zipfile import ZIP_DEFLATED, ZipFile
+from tempfile import TemporaryDirectory, mkdtemp
+from types import SimpleNamespace
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+#: Use ISA-L's much faster DEFLATE implementation for gzip attachments if python-isal is installed
+try:
+    from isal import igzip as gzip
+    GZIP_MAX_LEVEL = 3
+except ImportError:
+    import gzip
+    GZIP_MAX_LEVEL = 9
+
+#: Use libbase64's SIMD encoder for SendGrid attachments if pybase64 is installed; the output is identical
+try:
+    from pybase64 import b64encode
+except ImportError:
+    from base64 import b64encode
+
+#: zstd attachments are opt-in via the 'compression' email setting and need the zstandard package
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#: Level 1 is valid for both stdlib gzip (1-9) and isal (0-3) and gives the best speed for a comparable ratio
+GZIP_COMPRESS_LEVEL = 1
+GZIP_CHUNK_SIZE = 128 * 1024
+#: How many gzipped files to keep around for re-sending; the same log is often attached to message after message
+GZIP_CACHE_SIZE = 16
+#: Upper bound on the total size of the cached gzipped files; larger results are never cached
+GZIP_CACHE_MAX_BYTES = 32 * 1024 * 1024
+#: Files modified more recently than this aren't cached: a same-size rewrite within the filesystem's timestamp
+#: resolution (up to 2 s on FAT) would keep the old mtime and get the old gzip back
+GZIP_CACHE_MIN_AGE_NS = 2 * 10**9
+#: zstd's own default; compresses better than gzip level 1 at a similar speed
+ZSTD_COMPRESS_LEVEL = 3
+#: Zipping is mostly I/O and zlib, so more threads than this tend to just contend for the disk
+MAX_ATTACHMENT_WORKERS = 8
+#: Level 1 deflates much faster than zlib's default 6 for a slightly larger zip
+ZIP_COMPRESS_LEVEL = 1
+#: ZipFile.write copies members in 8 KiB pieces; a larger buffer means fewer Python-level read/write round trips
+ZIP_CHUNK_SIZE = 1024 * 1024
+#: Formats that are already compressed and won't shrink any further. EmailHandler attaches these as-is instead of
+#: gzipping them, and SendGridHandler stores them in its zips instead of deflating them (unless its
+#: zip_store_extensions setting replaces this list for SendGrid)
+COMPRESSED_SUFFIXES = frozenset({'.7z', '.bz2', '.gif', '.gz', '.jpeg', '.jpg', '.png', '.tgz', '.xz', '.zip', '.zst'})
+#: A multiple of 3 so every chunk but the last encodes without padding and the pieces concatenate exactly
+B64_CHUNK_SIZE = 3 * 64 * 1024
+#: How many zipped directories to keep around for re-sending; the same log directory is often sent on every alert
+ZIP_CACHE_SIZE = 8
+#: Upper bound on the total base64 size of the cached zipped directories; larger zips are never cached
+ZIP_CACHE_MAX_BYTES = 32 * 1024 * 1024
+#: Below this, setting up a memory map costs more than just reading the file
+MMAP_MIN_SIZE = 64 * 1024
+
+REQUIRED_EMAIL_SETTINGS = ('from_address', 'to_addresses', 'smtpServer', 'smtpPort')
+
+VERSION_FOOTER_TEMPLATE = '<p>{client_name} version: {client_version}</p>'
+
+#: (attachment, size) pairs for zipped directories, keyed by _directory_cache_key; oldest entries are dropped first
+_zipped_directories = {}
+#: (gzipped bytes, size) pairs keyed by (path, size, mtime_ns, compresslevel); oldest entries are dropped first
+_gzipped_files = {}
+#: Attachments are built in worker threads, so guards updates to both caches
+_cache_lock = threading.Lock()
+
+
+def _directory_cache_key(directory, compresslevel, store_suffixes):
+    """Build a key that changes whenever anything in the directory tree is added, removed, or modified
+
+    Args:
+        directory (str or Path): The directory to be zipped
+        compresslevel (int): The DEFLATE level it will be zipped with
+        store_suffixes (frozenset): The suffixes that will be stored uncompressed
+
+    Returns:
+        tuple: The directory's absolute path, each entry's relative path, size, and mtime, and the zip settings
+    """
+
+    directory = Path(directory)
+    signature = []
+    for path in sorted(directory.rglob('*')):
+        stat = path.stat()
+        signature.append((path.relative_to(directory).as_posix(), stat.st_size, stat.st_mtime_ns))
+
+    return os.path.abspath(directory), tuple(signature), compresslevel, store_suffixes
+
+
+def _remember(cache, cache_key, value, size, limits):
+    """Cache a value, dropping the oldest entries until it fits in the count and byte limits
+
+    Args:
+        cache (dict): The cache to add to; its values are (value, size) pairs
+        cache_key (tuple): The key to store value under
+        value (object): The value to cache
+        size (int): value's size in bytes
+        limits (tuple): How many entries the cache may hold and how many bytes their values may add up to; a value
+            larger than the byte limit is not cached at all
+
+    Returns:
+        object: The same value
+    """
+
+    max_entries, max_bytes = limits
+    if size > max_bytes:
+        return value
+
+    with _cache_lock:
+        cached_bytes = sum(cached_size for _, cached_size in cache.values())
+        while cache and (len(cache) >= max_entries or cached_bytes + size > max_bytes):
+            _, dropped_size = cache.pop(next(iter(cache)))
+            cached_bytes -= dropped_size
+        cache[cache_key] = (value, size)
+
+    return value
+
+
+def _remember_zipped_directory(cache_key, attachment, size):
+    """Cache a zipped directory's attachment, dropping the oldest ones until it fits in the count and byte limits
+
+    Args:
+        cache_key (tuple): From _directory_cache_key
+        attachment (Attachment): The attachment built from the directory's zip
+        size (int): The attachment's base64-encoded size in bytes
+
+    Returns:
+        Attachment: The same attachment
+    """
+
+    return _remember(_zipped_directories, cache_key, attachment, size, (ZIP_CACHE_SIZE, ZIP_CACHE_MAX_BYTES))
+
+
+@lru_cache(maxsize=None)
+def _render_version_footer(client_name, client_version):
+    """Render the html version footer once per client name/version pair instead of on every message
+
+    Args:
+        client_name (str): Name of the client project
+        client_version (str): Version of the client project
+
+    Returns:
+        str: html paragraph reporting the client's version
+    """
+
+    return VERSION_FOOTER_TEMPLATE.format_map({'client_name': client_name, 'client_version': client_version})
 
-import python_http_client
-import sendgrid
-from sendgrid.helpers.mail import Attachment, Content, Email, FileContent, FileName, FileType, Mail, To
+
+@lru_cache(maxsize=None)
+def _sendgrid_helpers():
+    """Import sendgrid and its dependencies the first time a SendGridHandler needs them
+
+    They're not imported at the top of the module so that programs that only use the other handlers don't pay for
+    importing them.
+
+    Returns:
+        SimpleNamespace: The sendgrid, python_http_client, and sendgrid.helpers.mail modules
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import python_http_client
+    import sendgrid
+    from sendgrid.helpers import mail
+
+    return SimpleNamespace(sendgrid=sendgrid, python_http_client=python_http_client, mail=mail)
+
+
+def _gzip_stream(input_file_object, compresslevel):
+    """gzip a binary stream from its current position, in fixed-size chunks so the whole plaintext is never held
+
+    Args:
+        input_file_object (binary file object): The stream to compress; it is left open
+        compresslevel (int): The gzip compression level
+
+    Returns:
+        bytes: The gzipped data
+    """
+
+    with io.BytesIO() as output_stream:
+        #: A fixed mtime keeps the output identical for identical input
+        with gzip.GzipFile(mode='wb', fileobj=output_stream, compresslevel=compresslevel, mtime=0) as gzipper:
+            copyfileobj(input_file_object, gzipper, GZIP_CHUNK_SIZE)
+        return output_stream.getvalue()
+
+
+def _gzip_file(path, compresslevel, cache=True):
+    """gzip a file, reusing the result while the file's size and modification time are unchanged
+
+    Args:
+        path (str or Path): The file to compress
+        compresslevel (int): The gzip compression level
+        cache (bool, optional): Whether to reuse and remember the result
+
+    Returns:
+        bytes: The gzipped contents of the file
+    """
+
+    if not cache:
+        with open(path, 'rb') as input_file_object:
+            return _gzip_stream(input_file_object, compresslevel)
+
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, compresslevel)
+    if (cached := _gzipped_files.get(cache_key)) is not None:
+        return cached[0]
+
+    with open(path, 'rb') as input_file_object:
+        gzipped = _gzip_stream(input_file_object, compresslevel)
+    if time.time_ns() - stat.st_mtime_ns < GZIP_CACHE_MIN_AGE_NS:
+        return gzipped
+    return _remember(_gzipped_files, cache_key, gzipped, len(gzipped), (GZIP_CACHE_SIZE, GZIP_CACHE_MAX_BYTES))
+
+
+def _map_for_reading(file):
+    """Memory-map a file opened for binary reading if it's big enough to be worth it
+
+    Args:
+        file (file object): The open file
+
+    Returns:
+        mmap.mmap or None: A read-only map of the whole file, or None if it is too small or has no file descriptor
+    """
+
+    try:
+        fileno = file.fileno()
+    except io.UnsupportedOperation:
+        return None
+    if os.fstat(fileno).st_size < MMAP_MIN_SIZE:
+        return None
+    return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
 
 
 class MessageHandler(ABC):  # pylint: disable=too-few-public-methods
@@ -28,6 +257,8 @@ class MessageHandler(ABC):  # pylint: disable=too-few-public-methods
     -------
     send_message(message_details)
         Parse a MessageDetails object and send a message using handler-specific logic
+    send_message_async(message_details)
+        Run send_message in a worker thread so an event loop isn't blocked while attachments are compressed and sent
     """
 
     @abstractmethod
@@ -40,6 +271,17 @@ class MessageHandler(ABC):  # pylint: disable=too-few-public-methods
             The data to be sent in the notification
         """
 
+    async def send_message_async(self, message_details):
+        """Run send_message in a worker thread so an event loop isn't blocked while attachments are compressed and sent
+
+        Parameters
+        ----------
+        message_details : MessageDetails
+            The data to be sent in the notification
+        """
+
+        await asyncio.to_thread(self.send_message, message_details)
+
 
 class EmailHandler(MessageHandler):  # pylint: disable=too-few-public-methods
     """Send a notification via email
@@ -48,23 +290,137 @@ class EmailHandler(MessageHandler):  # pylint: disable=too-few-public-methods
     ----------
     email_settings : dict
         From and To addresses, SMTP Server and Port
-    project_name : str
+    client_name : str (optional, default='unknown client')
         pip-install name of the client project for client version number reporting
+    client_version : str (optional, default='not specified')
+        client project's version for client version number reporting
 
     Methods
     -------
     send_message(message_details)
         Build a message, create an SMTP object, and send the message
+    _check_settings(email_settings)
+        Make sure all the required email settings exist and are populated, warning if they don't
+    _check_gzip_level(level)
+        Clamp a gzip_level setting to the range the active gzip implementation supports, warning if it's outside it
+    _join_addresses(to_addresses)
+        Join a list of recipient addresses into a single To header value
     _build_message(message_details)
-        Create email to be sent as a MIMEMultipart object
+        Create email to be sent as an EmailMessage object
     _build_gzip_attachment(input_path)
-        gzip input_path into a MIMEApplication object
+        gzip input_path into a MIMEPart object
+    _build_tar_gz_attachment(input_paths)
+        Bundle all input_paths into a single tar.gz MIMEPart object
+    _build_zstd_attachment(input_path)
+        zstd-compress input_path into a MIMEPart object
+    _build_uncompressed_attachment(input_path)
+        Attach an already-compressed file as-is in a MIMEPart object
+    _build_tar_zst_attachment(input_paths)
+        Bundle all input_paths into a single tar.zst MIMEPart object
     """
 
     def __init__(self, email_settings, client_name='unknown client', client_version='not specified'):
         self.email_settings = email_settings
         self.client_name = client_name
         self.client_version = client_version
+        #: Check once here so a misconfigured handler warns once instead of on every send_message call
+        self._settings_ok = self._check_settings(email_settings)
+        #: The recipients don't change between messages, so only join them once
+        self._to_header = self._join_addresses(email_settings.get('to_addresses'))
+        #: Caught here because an out-of-range level would otherwise only fail once there's something to attach
+        self._gzip_level = self._check_gzip_level(email_settings.get('gzip_level', GZIP_COMPRESS_LEVEL))
+        self._check_compression(email_settings.get('compression'))
+
+    @staticmethod
+    def _check_settings(email_settings):
+        """Make sure all the required email settings exist and are populated, warning if they don't
+
+        Parameters
+        ----------
+        email_settings : dict
+            The handler's email settings
+
+        Returns
+        -------
+        bool
+            True if all the required settings are present and populated
+        """
+
+        if not all(setting in email_settings for setting in REQUIRED_EMAIL_SETTINGS):
+            warnings.warn('Required email settings do not exist. No emails sent.')
+            return False
+
+        if not all(email_settings[setting] for setting in REQUIRED_EMAIL_SETTINGS):
+            warnings.warn('Required email settings exist but aren\'t populated. No emails sent.')
+            return False
+
+        return True
+
+    @staticmethod
+    def _check_gzip_level(level):
+        """Clamp a gzip_level setting to the range the active gzip implementation supports, warning if it's outside it
+
+        isal only supports levels 0-3, so a level that is valid for the standard library's gzip (0-9) can become
+        invalid just by installing isal.
+
+        Parameters
+        ----------
+        level : int
+            The requested gzip compression level
+
+        Returns
+        -------
+        int
+            level, or the nearest supported level if it is out of range
+        """
+
+        if 0 <= level <= GZIP_MAX_LEVEL:
+            return level
+
+        supported_level = min(max(level, 0), GZIP_MAX_LEVEL)
+        warnings.warn(
+            f'gzip_level {level} is outside the 0-{GZIP_MAX_LEVEL} range supported by {gzip.__name__}; using '
+            f'{supported_level} instead.'
+        )
+        return supported_level
+
+    @staticmethod
+    def _check_compression(compression):
+        """Warn if a compression setting asks for zstd but the zstandard package isn't installed
+
+        _build_message falls back to gzip in that case, so without a warning the misconfiguration goes unnoticed.
+
+        Parameters
+        ----------
+        compression : str or None
+            The requested attachment compression
+        """
+
+        if compression == 'zstd' and zstandard is None:
+            warnings.warn(
+                "compression 'zstd' needs the zstandard package, which is not installed; attachments will be gzipped "
+                'instead.'
+            )
+
+    @staticmethod
+    def _join_addresses(to_addresses):
+        """Join a list of recipient addresses into a single To header value
+
+        Parameters
+        ----------
+        to_addresses : str or list
+            A single address or a list of addresses
+
+        Returns
+        -------
+        str
+            to_addresses unchanged if it is a str (or empty), otherwise the addresses separated by commas
+        """
+
+        if not to_addresses or isinstance(to_addresses, str):
+            return to_addresses
+
+        return ','.join(to_addresses)
 
     def send_message(self, message_details):
         """Build a message, create an SMTP object, and send the message
@@ -75,30 +431,18 @@ class EmailHandler(MessageHandler):  # pylint: disable=too-few-public-methods
             Passed through to _build_message. Must have .message, .subject; may have .attachments
         """
 
-        #: Configure outgoing settings
-        try:
-            from_address = self.email_settings['from_address']
-            to_addresses = self.email_settings['to_addresses']
-            smtp_server = self.email_settings['smtpServer']
-            smtp_port = self.email_settings['smtpPort']
-
-        except KeyError:
-            warnings.warn('Required email settings do not exist. No emails sent.')
+        #: Already warned about in __init__
+        if not self._settings_ok:
             return
 
-        for setting in [from_address, to_addresses, smtp_server, smtp_port]:
-            if not setting:
-                warnings.warn('Required email settings exist but aren\'t populated. No emails sent.')
-                return
-
         message = self._build_message(message_details)
 
         #: Send message
-        with SMTP(smtp_server, smtp_port) as smtp:
-            smtp.sendmail(from_address, to_addresses, message.as_string())
+        with SMTP(self.email_settings['smtpServer'], self.email_settings['smtpPort']) as smtp:
+            smtp.sendmail(self.email_settings['from_address'], self.email_settings['to_addresses'], message.as_string())
 
     def _build_message(self, message_details):
-        """Create email to be sent as a MIMEMultipart object
+        """Create email to be sent as an EmailMessage object
 
         Parameters
         ----------
@@ -107,23 +451,15 @@ class EmailHandler(MessageHandler):  # pylint: disable=too-few-public-methods
 
         Returns
         -------
-        message : MIMEMultipart
+        message : EmailMessage
             A formatted message that can be passed to smtp.sendmail as message.as_string()
         """
 
-        #: Use body as message if it's already a MIMEMultipart, otherwise create a new MIMEMultipart as the message
-        message = MIMEMultipart()
-        message.attach(MIMEText(message_details.message, 'html'))
-
-        version = MIMEText(f'<p>{self.client_name} version: {self.client_version}</p>', 'html')
-        message.attach(version)
-
-        #: Split recipient addresses if needed.
-        to_addresses = self.email_settings['to_addresses']
-        if not isinstance(to_addresses, str):
-            to_addresses_joined = ','.join(to_addresses)
-        else:
-            to_addresses_joined = to_addresses
+        #: The body and the version footer are both inline html parts; adding the footer makes this multipart/mixed
+        message = EmailMessage()
+        message.set_content(message_details.message, subtype='html')
+        footer = _render_version_footer(self.client_name, self.client_version)
+        message.add_attachment(footer, subtype='html', disposition='inline')
 
         #: Add various elements of the message
         if 'prefix' in self.email_settings:
@@ -131,40 +467,202 @@ class EmailHandler(MessageHandler):  # pylint: disable=too-few-public-methods
         else:
             message['Subject'] = message_details.subject
         message['From'] = self.email_settings['from_address']
-        message['To'] = to_addresses_joined
+        message['To'] = self._to_header
+
+        #: Path() doesn't like None and empty string resolves to current dir, so drop them up front. Most messages
+        #: don't have attachments, so bail out before doing any Path/stat work.
+        original_paths = [original_path for original_path in message_details.attachments if original_path]
+        if not original_paths:
+            return message
+
+        attachment_paths = [path for path in map(Path, original_paths) if path.is_file()]
+
+        bundle = len(attachment_paths) > 1 and self.email_settings.get('bundle_attachments')
+        #: Only use zstd if it was asked for and zstandard is installed; fall back to gzip otherwise (__init__ warns)
+        use_zstd = self.email_settings.get('compression') == 'zstd' and zstandard is not None
+        level = self.email_settings.get('zstd_level', ZSTD_COMPRESS_LEVEL)
+        compresslevel = self._gzip_level
+        cache_gzips = self.email_settings.get('cache_gzips', True)
+
+        #: Either bundle all the attachments into a single tar archive or compress each one individually
+        if bundle and use_zstd:
+            message.attach(self._build_tar_zst_attachment(attachment_paths, level=level))
+        elif bundle:
+            message.attach(self._build_tar_gz_attachment(attachment_paths, compresslevel=compresslevel))
+        else:
 
-        #: gzip all attachments and add to message
-        for original_path in message_details.attachments:
-            if not original_path:  #: Path() doesn't like None and empty string resolves to current dir
-                continue
+            def _compress_attachment(path):
+                #: Already-compressed files won't get any smaller, so don't spend the time trying
+                if path.suffix.lower() in COMPRESSED_SUFFIXES:
+                    return self._build_uncompressed_attachment(path)
+                if use_zstd:
+                    return self._build_zstd_attachment(path, level=level)
+                return self._build_gzip_attachment(path, compresslevel=compresslevel, cache=cache_gzips)
 
-            path = Path(original_path)  #: convert to a Path if it isn't already
-            if path.is_file():
-                message.attach(self._build_gzip_attachment(path))
+            if len(attachment_paths) <= 1:
+                attachments = map(_compress_attachment, attachment_paths)
+            else:
+                #: zlib/zstd and file I/O release the GIL, so independent attachments can be compressed in parallel.
+                #: map() keeps the results in the same order as the attachments.
+                with ThreadPoolExecutor(max_workers=min(MAX_ATTACHMENT_WORKERS, len(attachment_paths))) as executor:
+                    attachments = list(executor.map(_compress_attachment, attachment_paths))
+            for attachment in attachments:
+                message.attach(attachment)
 
         return message
 
     @staticmethod
-    def _build_gzip_attachment(input_path):
-        """gzip input_path into a MIMEApplication object
+    def _build_gzip_attachment(input_source, filename=None, compresslevel=GZIP_COMPRESS_LEVEL, cache=True):
+        """gzip input_source into a MIMEPart object
+
+        Parameters
+        ----------
+        input_source : Path or binary file-like object
+            The on-disk path to the file to gzip, which will be opened in 'rb' mode, or an already-open binary stream,
+            which is read from its current position and left open.
+        filename : str, optional
+            The name of the original file; the attachment is named filename + '.gz'. Defaults to the path's name and
+            must be given for streams.
+        compresslevel : int, optional
+            The gzip compression level.
+        cache : bool, optional
+            Whether to reuse the gzip of an on-disk file whose size and modification time haven't changed. Streams are
+            never cached.
+
+        Returns
+        -------
+        attachment : MIMEPart
+            The gzip'ed contents of input_source ready to attach to a multipart EmailMessage.
+        """
+        if hasattr(input_source, 'read'):
+            if filename is None:
+                raise ValueError('filename must be given when gzipping a stream')
+            gzipped = _gzip_stream(input_source, compresslevel)
+        else:
+            filename = filename or Path(input_source).name
+            gzipped = _gzip_file(input_source, compresslevel, cache)
+
+        attachment = MIMEPart()
+        attachment.set_content(gzipped, maintype='application', subtype='x-gzip', filename=filename + '.gz')
+
+        return attachment
+
+    @staticmethod
+    def _build_tar_gz_attachment(input_paths, compresslevel=GZIP_COMPRESS_LEVEL):
+        """Bundle all input_paths into a single tar.gz MIMEPart object
+
+        Compressing the files as a single stream lets DEFLATE use redundancy across files (like similar log files)
+        and keeps the message to a single attachment part.
+
+        Parameters
+        ----------
+        input_paths : [Path]
+            The on-disk paths to the files to bundle. Each is stored in the archive under its file name.
+        compresslevel : int, optional
+            The gzip compression level.
+
+        Returns
+        -------
+        attachment : MIMEPart
+            The tar.gz'ed contents of input_paths ready to attach to a multipart EmailMessage.
+        """
+        with io.BytesIO() as output_stream:
+            #: Compress with our own GzipFile rather than tarfile's 'w:gz' so isal is used when available and the gzip
+            #: header's mtime is fixed. Dereference so a symlinked log is bundled as its contents, not an empty link.
+            with gzip.GzipFile(mode='wb', fileobj=output_stream, compresslevel=compresslevel, mtime=0) as gzipper, \
+                    tarfile.open(fileobj=gzipper, mode='w', dereference=True) as tar:
+                for input_path in input_paths:
+                    tar.add(input_path, arcname=input_path.name)
+            attachment = MIMEPart()
+            attachment.set_content(
+                output_stream.getvalue(), maintype='application', subtype='x-gzip', filename='attachments.tar.gz'
+            )
+
+            return attachment
+
+    @staticmethod
+    def _build_zstd_attachment(input_path, level=ZSTD_COMPRESS_LEVEL):
+        """zstd-compress input_path into a MIMEPart object
+
+        Requires the zstandard package.
 
         Parameters
         ----------
         input_path : Path
-            The on-disk path to the file to gzip. Will be opened in 'rb' mode.
+            The on-disk path to the file to compress.
+        level : int, optional
+            The zstd compression level.
 
         Returns
         -------
-        attachment : MIMEApplication
-            The gzip'ed contents of input_path ready to attach to a MIMEMultipart message.
+        attachment : MIMEPart
+            The zstd'ed contents of input_path ready to attach to a multipart EmailMessage.
         """
-        with (open(input_path, 'rb')) as input_file_object, io.BytesIO() as output_stream:
-            gzipper = gzip.GzipFile(mode='wb', fileobj=output_stream)
-            gzipper.writelines(input_file_object)
-            gzipper.close()
-            attachment = MIMEApplication(output_stream.getvalue(), 'x-gzip')
-            attachment_filename = input_path.name + '.gz'
-            attachment.add_header('Content-Disposition', f'attachment; filename="{attachment_filename}"')
+        with open(input_path, 'rb') as input_file_object, io.BytesIO() as output_stream:
+            zstandard.ZstdCompressor(level=level).copy_stream(input_file_object, output_stream)
+            attachment = MIMEPart()
+            attachment.set_content(
+                output_stream.getvalue(),
+                maintype='application',
+                subtype='zstd',
+                filename=Path(input_path).name + '.zst',
+            )
+
+            return attachment
+
+    @staticmethod
+    def _build_uncompressed_attachment(input_path):
+        """Attach an already-compressed file as-is in a MIMEPart object
+
+        Parameters
+        ----------
+        input_path : Path
+            The on-disk path to the file to attach.
+
+        Returns
+        -------
+        attachment : MIMEPart
+            The contents of input_path, typed by its extension, ready to attach to a multipart EmailMessage.
+        """
+        content_type, encoding = mimetypes.guess_type(input_path.name)
+        #: A compressed encoding (like .gz) means the guessed type is of the data inside, not the file itself
+        if content_type is None or encoding is not None:
+            content_type = 'application/octet-stream'
+        maintype, subtype = content_type.split('/')
+        attachment = MIMEPart()
+        attachment.set_content(input_path.read_bytes(), maintype=maintype, subtype=subtype, filename=input_path.name)
+
+        return attachment
+
+    @staticmethod
+    def _build_tar_zst_attachment(input_paths, level=ZSTD_COMPRESS_LEVEL):
+        """Bundle all input_paths into a single tar.zst MIMEPart object
+
+        Requires the zstandard package.
+
+        Parameters
+        ----------
+        input_paths : [Path]
+            The on-disk paths to the files to bundle. Each is stored in the archive under its file name.
+        level : int, optional
+            The zstd compression level.
+
+        Returns
+        -------
+        attachment : MIMEPart
+            The tar.zst'ed contents of input_paths ready to attach to a multipart EmailMessage.
+        """
+        with io.BytesIO() as output_stream:
+            compressor = zstandard.ZstdCompressor(level=level)
+            #: Dereference so a symlinked log is bundled as its contents, not an empty link
+            with compressor.stream_writer(output_stream, closefd=False) as zstd_writer, \
+                    tarfile.open(fileobj=zstd_writer, mode='w', dereference=True) as tar:
+                for input_path in input_paths:
+                    tar.add(input_path, arcname=input_path.name)
+            attachment = MIMEPart()
+            attachment.set_content(
+                output_stream.getvalue(), maintype='application', subtype='zstd', filename='attachments.tar.zst'
+            )
 
             return attachment
 
@@ -191,7 +689,7 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
 
     def __init__(self, sendgrid_settings, client_name='unknown client', client_version='not specified'):
         self.sendgrid_settings = sendgrid_settings
-        self.sendgrid_client = sendgrid.SendGridAPIClient(api_key=self.sendgrid_settings['api_key'])
+        self.sendgrid_client = _sendgrid_helpers().sendgrid.SendGridAPIClient(api_key=self.sendgrid_settings['api_key'])
         self.client_name = client_name
         self.client_version = client_version
 
@@ -202,6 +700,7 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
             message_details : MessageDetails
                 Must have .message, .subject; may have .attachments
         """
+        sendgrid_helpers = _sendgrid_helpers()
 
         from_address, to_addresses = self._verify_addresses()
         #: Bail out instead of raising error instead of forcing client to deal with it
@@ -209,7 +708,7 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
         if not from_address or not to_addresses:
             return
 
-        sender_address = Email(from_address)
+        sender_address = sendgrid_helpers.mail.Email(from_address)
         recipient_addresses = self._build_recipient_addresses(to_addresses)
 
         subject = self._build_subject(message_details)
@@ -219,16 +718,16 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
         attachments = self._process_attachments(verified_attachments)
 
         #: Build message object and send it
-        mail = Mail(sender_address, recipient_addresses, subject, content)
+        mail = sendgrid_helpers.mail.Mail(sender_address, recipient_addresses, subject, content)
         mail.attachment = attachments
         try:
             self.sendgrid_client.client.mail.send.post(request_body=mail.get())
-        except python_http_client.BadRequestsError as err:
+        except sendgrid_helpers.python_http_client.BadRequestsError as err:
             if 'HTTP Error 400: Bad Request' in str(err):
                 warnings.warn('SendGrid error 400, might be missing a required Mail component; no e-mail sent.')
             else:
                 raise err
-        except python_http_client.UnauthorizedError as err:
+        except sendgrid_helpers.python_http_client.UnauthorizedError as err:
             if 'HTTP Error 401: Unauthorized' in str(err):
                 warnings.warn('SendGrid error 401: Unauthorized. Check API key.')
             else:
@@ -265,12 +764,13 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
         Returns:
             list (To): 'To' objects for future Mail() object
         """
+        to_class = _sendgrid_helpers().mail.To
 
         #: If we just get a string just return that one
         if isinstance(to_addresses, str):
-            return [To(to_addresses)]
+            return [to_class(to_addresses)]
 
-        return [To(address) for address in to_addresses]
+        return [to_class(address) for address in to_addresses]
 
     def _build_subject(self, message_details):
         """Add prefix to subject if needed
@@ -299,11 +799,10 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
         Returns:
             Content: Content of email as a SendGrid Content object
         """
-
         client_version = f'\n\n{client_name} version: {client_version}'
         message += client_version
 
-        return Content('text/plain', message)
+        return _sendgrid_helpers().mail.Content('text/plain', message)
 
     @staticmethod
     def _verify_attachments(attachments):
@@ -344,53 +843,96 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
             Attachment: Attachment objects ready to be added to Mail
         """
 
-        attachment_objects = []
+        if not attachments:
+            return []
+
+        compresslevel = self.sendgrid_settings.get('zip_compresslevel', ZIP_COMPRESS_LEVEL)
+        store_suffixes = frozenset(
+            suffix.lower() for suffix in self.sendgrid_settings.get('zip_store_extensions', COMPRESSED_SUFFIXES)
+        )
+        cache_zips = self.sendgrid_settings.get('cache_zips', True)
 
         #: Note: if we use this context manager, zip files in working_dir don't persist for testing purposes.
         with TemporaryDirectory() as working_dir:
 
-            for attachment in attachments:
+            def _zip_and_build_attachment(attachment):
+                #: Zips are named after their source, so give each its own directory; logs/ under two different
+                #: parents (or a/x.log and b/x.log) would otherwise collide
+                scratch_dir = mkdtemp(dir=working_dir)
                 if Path(attachment).is_dir():
-                    zip_path = self._zip_whole_directory(working_dir, attachment)
-                else:
-                    zip_path = self._zip_single_file(working_dir, attachment)
-                attachment_objects.append(self._build_attachment(zip_path))
-
-        return attachment_objects
+                    if not cache_zips:
+                        zip_path = self._zip_whole_directory(scratch_dir, attachment, compresslevel, store_suffixes)
+                        return self._build_attachment(zip_path)
+                    #: Walking the tree for sizes and mtimes is much cheaper than zipping and encoding it again
+                    cache_key = _directory_cache_key(attachment, compresslevel, store_suffixes)
+                    if (cached := _zipped_directories.get(cache_key)) is not None:
+                        return cached[0]
+                    zip_path = self._zip_whole_directory(scratch_dir, attachment, compresslevel, store_suffixes)
+                    encoded_size = (os.path.getsize(zip_path) + 2) // 3 * 4
+                    return _remember_zipped_directory(cache_key, self._build_attachment(zip_path), encoded_size)
+                zip_path = self._zip_single_file(scratch_dir, attachment, compresslevel, store_suffixes)
+                return self._build_attachment(zip_path)
+
+            if len(attachments) == 1:
+                return [_zip_and_build_attachment(attachments[0])]
+
+            #: zlib and file I/O release the GIL, so independent attachments can be zipped and encoded in parallel.
+            #: map() keeps the results in the same order as the attachments.
+            with ThreadPoolExecutor(max_workers=min(MAX_ATTACHMENT_WORKERS, len(attachments))) as executor:
+                return list(executor.map(_zip_and_build_attachment, attachments))
 
     @staticmethod
-    def _zip_whole_directory(working_dir, dir_to_be_zipped):
+    def _zip_whole_directory(
+        working_dir, dir_to_be_zipped, compresslevel=ZIP_COMPRESS_LEVEL, store_suffixes=COMPRESSED_SUFFIXES
+    ):
         """Create a zipfile containing a directory and all its contents
 
         Args:
             working_dir (str or Path): A directory to store the new zipfile
             dir_to_be_zipped (str or Path): The directory to be zipped
+            compresslevel (int, optional): The DEFLATE level for compressed members
+            store_suffixes (set, optional): Lower-case file suffixes to store uncompressed
 
         Returns:
             str: Path to the new zipfile
         """
 
         attachment_dir = Path(dir_to_be_zipped)
-        zip_base_name = Path(working_dir, attachment_dir.name)
-        zip_out_path = make_archive(
-            str(zip_base_name), 'zip', root_dir=attachment_dir.parent, base_dir=attachment_dir.name
-        )
-        return zip_out_path
+        zip_out_path = Path(working_dir, attachment_dir.name + '.zip')
+        with ZipFile(zip_out_path, 'x', compression=ZIP_DEFLATED, compresslevel=compresslevel) as new_zip:
+            #: Sorted so the archive's member order doesn't depend on the filesystem; directories get their own
+            #: entries (with a trailing /) so empty ones survive
+            for path in sorted([attachment_dir, *attachment_dir.rglob('*')]):
+                arcname = path.relative_to(attachment_dir.parent).as_posix()
+                if path.is_dir():
+                    new_zip.write(path, arcname)
+                else:
+                    member = ZipInfo.from_file(path, arcname)
+                    member.compress_type = ZIP_STORED if path.suffix.lower() in store_suffixes else ZIP_DEFLATED
+                    #: ZipFile.write fills this in from the archive's level, but open() takes the member's as-is; the
+                    #: attribute only became public (as compress_level) in Python 3.13
+                    member._compresslevel = compresslevel  # pylint: disable=protected-access
+                    with open(path, 'rb') as source, new_zip.open(member, 'w') as destination:
+                        copyfileobj(source, destination, ZIP_CHUNK_SIZE)
+        return str(zip_out_path)
 
     @staticmethod
-    def _zip_single_file(working_dir, attachment):
+    def _zip_single_file(working_dir, attachment, compresslevel=ZIP_COMPRESS_LEVEL, store_suffixes=COMPRESSED_SUFFIXES):
         """Create a zipfile containing a single file
 
         Args:
             working_dir (str or Path): A directory to store the new zipfile
             attachment (str or Path): The file to be zipped
+            compresslevel (int, optional): The DEFLATE level if the file is compressed
+            store_suffixes (set, optional): Lower-case file suffixes to store uncompressed
 
         Returns:
             Path: Path to the new zipfile
         """
         attachment_path = Path(attachment)
         zip_out_path = Path(working_dir, attachment_path.stem).with_suffix('.zip')
-        with ZipFile(zip_out_path, 'x', compression=ZIP_DEFLATED) as new_zip:
+        compression = ZIP_STORED if attachment_path.suffix.lower() in store_suffixes else ZIP_DEFLATED
+        with ZipFile(zip_out_path, 'x', compression=compression, compresslevel=compresslevel) as new_zip:
             new_zip.write(attachment_path, attachment_path.name)
         return zip_out_path
 
@@ -404,14 +946,25 @@ class SendGridHandler(MessageHandler):  # pylint: disable=too-few-public-methods
         Returns:
             Attachment: Attachment object ready to be added to Mail object.
         """
+        #: Encode in chunks so the raw zip is never held in memory alongside its base64 text
+        with open(zip_path, 'rb') as zip_file, io.BytesIO() as encoded_stream:
+            mapped_file = _map_for_reading(zip_file)
+            if mapped_file is None:
+                while chunk := zip_file.read(B64_CHUNK_SIZE):
+                    encoded_stream.write(b64encode(chunk))
+            else:
+                #: Slicing the memoryview encodes straight from the page cache without copying into a read buffer
+                with mapped_file, memoryview(mapped_file) as view:
+                    for start in range(0, len(view), B64_CHUNK_SIZE):
+                        encoded_stream.write(b64encode(view[start:start + B64_CHUNK_SIZE]))
+            encoded = str(encoded_stream.getbuffer(), 'ascii')
+
         #: Build a SendGrid Attachment object with various fields
-        with open(zip_path, 'rb') as zip_file:
-            data = zip_file.read()
-        encoded = b64encode(data).decode()
-        attachment = Attachment()
-        attachment.file_content = FileContent(encoded)
-        attachment.file_type = FileType('application/zip')
-        attachment.file_name = FileName(Path(zip_path).name)
+        mail_helpers = _sendgrid_helpers().mail
+        attachment = mail_helpers.Attachment()
+        attachment.file_content = mail_helpers.FileContent(encoded)
+        attachment.file_type = mail_helpers.FileType('application/zip')
+        attachment.file_name = mail_helpers.FileName(Path(zip_path).name)
         return attachment
 
 
@@ -430,12 +983,29 @@ class SlackHandler(MessageHandler):  # pylint: disable=too-few-public-methods
 class ConsoleHandler(MessageHandler):  # pylint: disable=too-few-public-methods
     """Send a notification to the console.
 
+    Can be used as a context manager to batch many messages into a single write to stdout when the block exits.
+
     Methods
     -------
     send_message(message_details)
-        Print message_details.message
+        Print message_details.message, or buffer it if inside a with block
     """
 
+    def __init__(self):
+        self._buffer = None
+
+    def __enter__(self):
+        self._buffer = io.StringIO()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        buffer, self._buffer = self._buffer, None
+        sys.stdout.write(buffer.getvalue())
+        sys.stdout.flush()
+
     def send_message(self, message_details):
-        """Print message_details.message"""
-        print(message_details.message)
+        """Print message_details.message, or buffer it if inside a with block"""
+        if self._buffer is None:
+            print(message_details.message)
+        else:
+            print(message_details.message, file=self._buffer)
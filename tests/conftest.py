@@ -0,0 +1,129 @@
+import copy
+import os
+import shutil
+import sys
+import zipfile
+from base64 import b64encode
+from functools import cached_property
+from pathlib import Path
+from types import MappingProxyType
+from unittest import mock
+
+import pytest
+
+from supervisor import message_handlers
+from supervisor.models import MessageDetails
+
+#: Read-only so the copies of the shared handler can't change each other's settings; rebind to a new dict instead
+SENDGRID_SETTINGS = MappingProxyType({
+    'from_address': 'foo@example.com',
+    'to_addresses': 'cheddar@example.com',
+    'api_key': 'its_a_secret',
+})
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    #: Opt in with SUPERVISOR_TEST_TMPFS=1 to keep the tests' zip scratch files in RAM when no --basetemp was given.
+    #: pytest empties an explicit basetemp at the start of every run, so the path is unique to this user and process,
+    #: and removed again afterwards because pytest won't clean it up.
+    if config.option.basetemp or not os.environ.get('SUPERVISOR_TEST_TMPFS'):
+        return
+    if sys.platform == 'linux' and os.path.isdir('/dev/shm'):
+        basetemp = f'/dev/shm/pytest-supervisor-{os.getuid()}-{os.getpid()}'
+        config.option.basetemp = basetemp
+        config.add_cleanup(lambda: shutil.rmtree(basetemp, ignore_errors=True))
+
+
+@pytest.fixture
+def make_message_details():
+
+    def _make_message_details(message='', subject='', attachments=None):
+        message_details = MessageDetails()
+        message_details.message = message
+        message_details.subject = subject
+        if attachments is not None:
+            message_details.attachments = attachments
+
+        return message_details
+
+    return _make_message_details
+
+
+@pytest.fixture
+def message_details(make_message_details):
+    return make_message_details('test_message', 'test_subject')
+
+
+@pytest.fixture(scope='session')
+def attachment_files(tmp_path_factory):
+    #: Written once per session; tests must treat these as read-only
+    root = tmp_path_factory.mktemp('attachments')
+    (root / 'single.txt').write_bytes(b'single')
+    dir_to_be_attached = root / 'zip_me'
+    dir_to_be_attached.mkdir()
+    (dir_to_be_attached / 'a.txt').write_bytes(b'a')
+    (dir_to_be_attached / 'b.txt').write_bytes(b'b')
+
+    return root
+
+
+class PrebuiltZip:
+    """A zipfile built once per session; its contents and their base64 encoding are read on first use"""
+
+    def __init__(self, source_path, zip_path):
+        self.source_path = source_path
+        self.zip_path = zip_path
+
+    @cached_property
+    def zip_bytes(self):
+        return Path(self.zip_path).read_bytes()
+
+    @cached_property
+    def names(self):
+        with zipfile.ZipFile(self.zip_path) as prebuilt_zip:
+            return tuple(sorted(prebuilt_zip.namelist()))
+
+    @cached_property
+    def b64(self):
+        return b64encode(self.zip_bytes).decode()
+
+
+@pytest.fixture(scope='session')
+def three_attachment_files(tmp_path_factory):
+    #: Read-only; att1.txt through att3.txt, each containing its own stem
+    root = tmp_path_factory.mktemp('three_attachments')
+    paths = [root / f'att{i}.txt' for i in range(1, 4)]
+    for path in paths:
+        path.write_bytes(path.stem.encode())
+
+    return paths
+
+
+@pytest.fixture(scope='session')
+def prebuilt_zip_dir(attachment_files, tmp_path_factory):
+    #: Zip attachment_files/zip_me once per session for read-only tests
+    dir_to_be_zipped = attachment_files / 'zip_me'
+    zip_path = message_handlers.SendGridHandler._zip_whole_directory(tmp_path_factory.mktemp('zips'), dir_to_be_zipped)
+
+    return PrebuiltZip(dir_to_be_zipped, zip_path)
+
+
+@pytest.fixture(scope='module')
+def sendgrid_handler_template():
+    #: The client is only created in __init__, so the patch doesn't need to outlive construction
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr('sendgrid.SendGridAPIClient', mock.MagicMock())
+
+        return message_handlers.SendGridHandler(SENDGRID_SETTINGS, 'ProFoo', '3.14')
+
+
+@pytest.fixture
+def sendgrid_handler(sendgrid_handler_template):
+    #: Copy the module-wide handler so attribute changes stay local, then reset the shared client mock afterwards
+    #: so call_args and side effects don't leak between tests
+    sendgrid_handler = copy.copy(sendgrid_handler_template)
+
+    yield sendgrid_handler
+
+    sendgrid_handler.sendgrid_client.reset_mock(side_effect=True)
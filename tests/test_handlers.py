@@ -1,1115 +1,581 @@
-import base64
-import zipfile
-from base64 import b64encode
+import asyncio
+import gzip
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import warnings
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from unittest import mock
+from types import MappingProxyType, SimpleNamespace
 
 import pytest
-import python_http_client
 
-from supervisor import message_handlers, models
+from supervisor import message_handlers
 from supervisor.models import MessageDetails
 
+#: Read-only so a test can't accidentally mutate the settings seen by later tests; copy it to make changes
+BASE_EMAIL_SETTINGS = MappingProxyType({
+    'to_addresses': 'foo@example.com',
+    'from_address': 'testing@example.com',
+})
 
-def test_console_handler_prints(mocker, capsys):
+#: A complete set of the settings EmailHandler requires before it will send
+SMTP_EMAIL_SETTINGS = MappingProxyType({
+    'smtpServer': 'foo.example',
+    'smtpPort': 25,
+    'from_address': 'foo@bar',
+    'to_addresses': 'baz@bar',
+})
 
-    handler_mock = mocker.Mock()
-    message_details = MessageDetails()
-    message_details.message = 'foo'
-    message_handlers.ConsoleHandler.send_message(handler_mock, message_details)
+#: Marks a setting to be removed entirely rather than blanked
+_MISSING = object()
 
-    captured = capsys.readouterr()
 
-    assert captured.out == 'foo\n'
+def test_importing_handlers_does_not_import_sendgrid():
+    #: A fresh interpreter, because the test session has already imported sendgrid
+    code = 'import sys, supervisor.message_handlers; sys.exit("sendgrid" in sys.modules)'
 
+    result = subprocess.run([sys.executable, '-c', code], env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
 
-def test_build_message_without_attachments(mocker):
+    assert result.returncode == 0
 
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': 'foo@example.com',
-        'from_address': 'testing@example.com',
-    }
-    handler_mock.client_name = 'testing'
-    handler_mock.client_version = 0
+def test_console_handler_prints(capsys, make_message_details):
 
-    test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
+    message_handlers.ConsoleHandler().send_message(make_message_details('foo'))
 
-    assert test_message.get('Subject') == 'test_subject'
-    assert test_message.get('To') == 'foo@example.com'
-    assert test_message.get('From') == 'testing@example.com'
-    assert test_message.get_payload()[0].get_payload() == 'test_message'
-    assert test_message.get_payload()[1].get_payload() == '<p>testing version: 0</p>'
+    captured = capsys.readouterr()
 
+    assert captured.out == 'foo\n'
 
-def test_build_message_with_None_attachment(mocker):
 
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
-    message_details.attachments = [None]
+def test_console_handler_buffers_messages_until_exit(capsys, make_message_details):
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': 'foo@example.com',
-        'from_address': 'testing@example.com',
-    }
-    handler_mock.client_name = 'testing'
-    handler_mock.client_version = 0
+    first_details = make_message_details('foo')
+    second_details = make_message_details('bar')
 
-    test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
+    with message_handlers.ConsoleHandler() as console_handler:
+        console_handler.send_message(first_details)
+        console_handler.send_message(second_details)
 
-    assert test_message.get('Subject') == 'test_subject'
-    assert test_message.get('To') == 'foo@example.com'
-    assert test_message.get('From') == 'testing@example.com'
-    assert test_message.get_payload()[0].get_payload() == 'test_message'
-    assert test_message.get_payload()[1].get_payload() == '<p>testing version: 0</p>'
+        assert capsys.readouterr().out == ''
 
+    assert capsys.readouterr().out == 'foo\nbar\n'
 
-def test_build_message_with_empty_str_attachment_path(mocker):
 
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
-    message_details.attachments = ['']
+def test_send_message_async_runs_in_worker_thread(make_message_details):
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': 'foo@example.com',
-        'from_address': 'testing@example.com',
-    }
-    handler_mock.client_name = 'testing'
-    handler_mock.client_version = 0
+    class RecordingHandler(message_handlers.MessageHandler):
 
-    test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
+        def send_message(self, message_details):
+            self.sent = (message_details, threading.get_ident())
 
-    assert test_message.get('Subject') == 'test_subject'
-    assert test_message.get('To') == 'foo@example.com'
-    assert test_message.get('From') == 'testing@example.com'
-    assert test_message.get_payload()[0].get_payload() == 'test_message'
-    assert test_message.get_payload()[1].get_payload() == '<p>testing version: 0</p>'
+    details = make_message_details('foo')
+    handler = RecordingHandler()
 
+    asyncio.run(handler.send_message_async(details))
 
-def test_build_message_with_subject_prefix(mocker):
+    assert handler.sent[0] is details
+    assert handler.sent[1] != threading.get_ident()
 
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': 'foo@example.com',
-        'from_address': 'testing@example.com',
-        'prefix': 'test prefix: ',
-    }
+@pytest.fixture(scope='module')
+def handler_mock_template(module_mocker):
+    handler_mock = module_mocker.Mock(spec=message_handlers.EmailHandler)
     handler_mock.client_name = 'testing'
     handler_mock.client_version = 0
 
-    test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
-
-    assert test_message.get('Subject') == 'test prefix: test_subject'
-    assert test_message.get('To') == 'foo@example.com'
+    return handler_mock
+
+
+@pytest.fixture
+def handler_mock(handler_mock_template):
+    #: Resetting the spec'd mock is cheaper than rebuilding it; a copy.copy would share its child mocks anyway
+    handler_mock_template.reset_mock(return_value=True, side_effect=True)
+    handler_mock_template.email_settings = dict(BASE_EMAIL_SETTINGS)
+    handler_mock_template._to_header = BASE_EMAIL_SETTINGS['to_addresses']
+    handler_mock_template._gzip_level = message_handlers.GZIP_COMPRESS_LEVEL
+
+    return handler_mock_template
+
+
+@pytest.mark.parametrize(
+    'extra_settings, attachments, expected_subject, expected_to',
+    [
+        ({}, [], 'test_subject', 'foo@example.com'),
+        ({}, [None], 'test_subject', 'foo@example.com'),
+        ({}, [''], 'test_subject', 'foo@example.com'),
+        ({}, [Path('')], 'test_subject', 'foo@example.com'),
+        ({
+            'prefix': 'test prefix: '
+        }, [], 'test prefix: test_subject', 'foo@example.com'),
+        (
+            {
+                'to_addresses': ['foo@example.com', 'bar@example.com', 'baz@example.com']
+            },
+            [],
+            'test_subject',
+            'foo@example.com, bar@example.com, baz@example.com',
+        ),
+    ],
+    ids=[
+        'without_attachments',
+        'None_attachment',
+        'empty_str_attachment_path',
+        'empty_Path_attachment',
+        'subject_prefix',
+        'multiple_to_addresses',
+    ],
+)
+def test_build_message(message_details, extra_settings, attachments, expected_subject, expected_to):
+    message_details.attachments = attachments
+
+    #: Only attribute reads are needed; a missing _build_gzip_attachment also proves nothing got attached
+    email_settings = {**BASE_EMAIL_SETTINGS, **extra_settings}
+    handler_stub = SimpleNamespace(
+        email_settings=email_settings,
+        client_name='testing',
+        client_version=0,
+        _to_header=message_handlers.EmailHandler._join_addresses(email_settings['to_addresses']),
+        _gzip_level=message_handlers.GZIP_COMPRESS_LEVEL,
+    )
+
+    test_message = message_handlers.EmailHandler._build_message(handler_stub, message_details)
+
+    assert test_message.get('Subject') == expected_subject
+    assert test_message.get('To') == expected_to
     assert test_message.get('From') == 'testing@example.com'
-    assert test_message.get_payload()[0].get_payload() == 'test_message'
-    assert test_message.get_payload()[1].get_payload() == '<p>testing version: 0</p>'
+    assert test_message.get_payload()[0].get_content() == 'test_message\n'
+    assert test_message.get_payload()[1].get_content() == '<p>testing version: 0</p>\n'
 
 
-def test_build_message_with_multiple_to_addresses(mocker):
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
+def test_render_version_footer_is_cached():
+    message_handlers._render_version_footer.cache_clear()
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': ['foo@example.com', 'bar@example.com', 'baz@example.com'],
-        'from_address': 'testing@example.com',
-    }
-    handler_mock.client_name = 'testing'
-    handler_mock.client_version = 0
+    first = message_handlers._render_version_footer('testing', 0)
+    second = message_handlers._render_version_footer('testing', 0)
 
-    test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
+    assert first == '<p>testing version: 0</p>'
+    assert second is first
+    assert message_handlers._render_version_footer.cache_info().hits == 1
 
-    assert test_message.get('Subject') == 'test_subject'
-    assert test_message.get('To') == 'foo@example.com,bar@example.com,baz@example.com'
-    assert test_message.get('From') == 'testing@example.com'
-    assert test_message.get_payload()[0].get_payload() == 'test_message'
-    assert test_message.get_payload()[1].get_payload() == '<p>testing version: 0</p>'
 
+def test_email_handler_joins_addresses_once():
+    email_handler = message_handlers.EmailHandler({
+        **SMTP_EMAIL_SETTINGS, 'to_addresses': ['foo@bar', 'baz@bar']
+    }, 'testing', 0)
+
+    assert email_handler._to_header == 'foo@bar,baz@bar'
 
-def test_gzip_not_called_for_non_existent_attachments(mocker, tmp_path):
 
-    distribution_Mock = mocker.Mock()
-    distribution_Mock.version = 0
-    distributions = [distribution_Mock]
-    mocker.patch('pkg_resources.require', return_value=distributions)
+def test_gzip_not_called_for_non_existent_attachments(tmp_path, handler_mock, message_details):
 
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
-    message_details.project_name = 'testing'
     message_details.attachments = [
         tmp_path / 'att1',
     ]
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': 'foo@example.com',
-        'from_address': 'testing@example.com',
-    }
-
     test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
     assert not handler_mock._build_gzip_attachment.called
 
 
-def test_gzip_not_called_for_empty_str_attachment_path(mocker):
-
-    distribution_Mock = mocker.Mock()
-    distribution_Mock.version = 0
-    distributions = [distribution_Mock]
-    mocker.patch('pkg_resources.require', return_value=distributions)
+def test_gzip_not_called_for_empty_str_attachment_path(handler_mock, message_details):
 
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
-    message_details.project_name = 'testing'
     message_details.attachments = ['']
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': 'foo@example.com',
-        'from_address': 'testing@example.com',
-    }
-
     test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
     assert not handler_mock._build_gzip_attachment.called
 
 
-def test_gzip_called_3_times_for_3_attachments(mocker, tmp_path):
-
-    distribution_Mock = mocker.Mock()
-    distribution_Mock.version = 0
-    distributions = [distribution_Mock]
-    mocker.patch('pkg_resources.require', return_value=distributions)
-
-    attributes = []
-    for i in range(1, 4):
-        path = tmp_path / f'att{i}'
-        with open(path, 'w') as attribute_file:
-            attribute_file.write(f'att{i}')
-        attributes.append(path)
-
-    message_details = MessageDetails()
-    message_details.message = 'test_message'
-    message_details.subject = 'test_subject'
-    message_details.project_name = 'testing'
-    message_details.attachments.extend(attributes)
+def test_gzip_called_3_times_for_3_attachments(three_attachment_files, handler_mock, message_details):
 
-    handler_mock = mocker.Mock()
-    handler_mock.email_settings = {
-        'to_addresses': 'foo@example.com',
-        'from_address': 'testing@example.com',
-    }
+    message_details.attachments.extend(three_attachment_files)
 
     test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
     assert handler_mock._build_gzip_attachment.call_count == 3
 
 
-def test_gzip(mocker, tmp_path):
-    # with BytesIO(b'test text') as test_bytes:
-    #     # mocker.patch.object(message_handlers.EmailHandler._build_gzip_attachment, 'input_file_object', test_bytes)
-    #     mocker.patch('sys.open', return_value=test_bytes)
-
-    temp_path = tmp_path / 'test'
-    with open(temp_path, 'w') as temp_file:
-        temp_file.write('test text')
-    temp_name = temp_path.name + '.gz'
-
-    attachment = message_handlers.EmailHandler._build_gzip_attachment(temp_path)
-
-    assert attachment.get_content_type() == 'application/x-gzip'
-    assert attachment.get_content_disposition() == 'attachment'
-    assert attachment.get_payload()
-
-    # email_settings = {
-    #     'smtpServer': 'foo.example',
-    #     'smtpPort': 25,
-    #     'from_address': 'foo@bar',
-    #     'to_addresses': 'baz@bar',
-    # }
-
-
-def test_send_message_catches_missing_server(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpPort': 25,
-        'from_address': 'foo@bar',
-        'to_addresses': 'baz@bar',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
-
+def test_parallel_gzip_keeps_attachment_order(three_attachment_files, message_details):
 
-def test_send_message_catches_missing_port(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpServer': 'foo.example',
-        'from_address': 'foo@bar',
-        'to_addresses': 'baz@bar',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
-
-
-def test_send_message_catches_missing_from_address(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpServer': 'foo.example',
-        'smtpPort': 25,
-        'to_addresses': 'baz@bar',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
-
-
-def test_send_message_catches_missing_to_address(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpServer': 'foo.example',
-        'smtpPort': 25,
-        'from_address': 'foo@bar',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
-
-
-def test_send_message_catches_blank_server(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpServer': '',
-        'smtpPort': 25,
-        'from_address': 'foo@bar',
-        'to_addresses': 'baz@bar',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
-
-
-def test_send_message_catches_blank_port(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpServer': 'foo.example',
-        'smtpPort': None,
-        'from_address': 'foo@bar',
-        'to_addresses': 'baz@bar',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
-
-
-def test_send_message_catches_blank_from_address(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpServer': 'foo.example',
-        'smtpPort': 25,
-        'from_address': '',
-        'to_addresses': 'baz@bar',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
+    message_details.attachments.extend(three_attachment_files)
+    email_handler = message_handlers.EmailHandler(SMTP_EMAIL_SETTINGS, 'testing', 0)
 
+    test_message = email_handler._build_message(message_details)
 
-def test_send_message_catches_blank_to_address(mocker):
-
-    builder_mock = mocker.patch('supervisor.message_handlers.EmailHandler._build_message')
-    email_settings = {
-        'smtpServer': 'foo.example',
-        'smtpPort': 25,
-        'from_address': 'foo@bar',
-        'to_addresses': '',
-    }
-    details = mocker.Mock()
-
-    with pytest.warns(UserWarning):
-        email_handler = message_handlers.EmailHandler(email_settings)
-        email_handler.send_message(details)
-
-    builder_mock.assert_not_called()
-
-
-class TestSendGridHandlerParts:
-
-    def test_verify_addresses_normal(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock.sendgrid_settings = {'from_address': 'foo@bar.com', 'to_addresses': 'cheddar@baz.com'}
-        from_addr, to_addr = message_handlers.SendGridHandler._verify_addresses(sendgrid_mock)
-        assert from_addr == 'foo@bar.com'
-        assert to_addr == 'cheddar@baz.com'
-
-    def test_verify_addresses_no_to_address(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock.sendgrid_settings = {'from_address': 'foo@bar.com'}
-        with pytest.warns(UserWarning, match='To/From address settings do not exist. No emails sent.'):
-            from_addr, _ = message_handlers.SendGridHandler._verify_addresses(sendgrid_mock)
-            assert from_addr is None
-
-    def test_verify_addresses_no_from_address(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock.sendgrid_settings = {'to_addresses': 'foo@bar.com'}
-        with pytest.warns(UserWarning, match='To/From address settings do not exist. No emails sent.'):
-            _, to_addr = message_handlers.SendGridHandler._verify_addresses(sendgrid_mock)
-            assert to_addr is None
-
-    def test_verify_addresses_empty_from_address(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock.sendgrid_settings = {
-            'from_address': '',
-            'to_addresses': 'foo@bar.com',
-        }
-        with pytest.warns(UserWarning, match='To/From address settings exist but are empty. No emails sent.'):
-            from_addr, _ = message_handlers.SendGridHandler._verify_addresses(sendgrid_mock)
-            assert from_addr is None
-
-    def test_verify_addresses_empty_to_address(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock.sendgrid_settings = {
-            'from_address': 'foo@bar.com',
-            'to_addresses': '',
-        }
-        with pytest.warns(UserWarning, match='To/From address settings exist but are empty. No emails sent.'):
-            _, to_addr = message_handlers.SendGridHandler._verify_addresses(sendgrid_mock)
-            assert to_addr is None
-
-    def test_build_recipient_addresses_one_addr(self, mocker):
-        to_addr = 'foo@bar.com'
-        recipient_list = message_handlers.SendGridHandler._build_recipient_addresses(to_addr)
-        assert len(recipient_list) == 1
-        assert recipient_list[0].email == 'foo@bar.com'
-
-    def test_build_recipient_addresses_multiple_addresses(self, mocker):
-        to_addr = ['foo@bar.com', 'cheddar@baz.com']
-        recipient_list = message_handlers.SendGridHandler._build_recipient_addresses(to_addr)
-        assert len(recipient_list) == 2
-        assert recipient_list[0].email == 'foo@bar.com'
-        assert recipient_list[1].email == 'cheddar@baz.com'
-
-    def test_build_subject_no_prefix(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock.sendgrid_settings = {}
-        message_details = models.MessageDetails()
-        message_details.subject = 'Foo Subject'
-        subject = message_handlers.SendGridHandler._build_subject(sendgrid_mock, message_details)
-        assert subject == 'Foo Subject'
-
-    def test_build_subject_add_prefix(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock.sendgrid_settings = {}
-        sendgrid_mock.sendgrid_settings['prefix'] = 'Bar Prefix—'
-        message_details = models.MessageDetails()
-        message_details.subject = 'Foo Subject'
-        subject = message_handlers.SendGridHandler._build_subject(sendgrid_mock, message_details)
-        assert subject == 'Bar Prefix—Foo Subject'
-
-    def test_build_content_with_version(self, mocker):
-
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmessage with newlines'
-        client_name = 'ProFoo'
-        client_version = 0
-
-        content_object = message_handlers.SendGridHandler._build_content(
-            message_details.message, client_name, client_version
-        )
-        assert content_object.content == 'This is a\nmessage with newlines\n\nProFoo version: 0'
-        assert content_object.mime_type == 'text/plain'
-
-    def test_verify_attachments_bad_Path_input(self, mocker):
-        attachments = [3]
-
-        error_message, attachments = message_handlers.SendGridHandler._verify_attachments(attachments)
-
-        assert 'Cannot get Path() of attachment' in error_message
-        assert attachments == []
-
-    def test_verify_attachments_Path_does_not_exist(self, mocker, tmp_path):
-        bad_path = tmp_path / 'bad.txt'
-
-        attachments = [bad_path]
-
-        error_message, attachments = message_handlers.SendGridHandler._verify_attachments(attachments)
-
-        assert 'does not exist' in error_message
-        assert attachments == []
-
-    def test_verify_attachments_good_Path(self, mocker, tmp_path):
-        good_path = tmp_path / 'a.txt'
-        good_path.write_text('a')
-
-        attachments = [good_path]
-
-        error_message, attachments = message_handlers.SendGridHandler._verify_attachments(attachments)
-
-        assert error_message == ''
-        assert attachments == [Path(good_path)]
-
-    def test_verify_attachments_good_Path_and_bad_Path_input(self, mocker, tmp_path):
-        good_path = tmp_path / 'a.txt'
-        good_path.write_text('a')
-
-        attachments = [good_path, 3]
-
-        error_message, attachments = message_handlers.SendGridHandler._verify_attachments(attachments)
-
-        assert 'Cannot get Path() of attachment' in error_message
-        assert attachments == [Path(good_path)]
-
-    def test_verify_attachments_good_Path_and_Path_not_exist(self, mocker, tmp_path):
-        good_path = tmp_path / 'a.txt'
-        good_path.write_text('a')
-        bad_path = tmp_path / 'b.txt'
-
-        attachments = [good_path, bad_path]
+    #: The inline version footer is also an attachment part, but without a filename
+    assert [part.get_filename() for part in test_message.iter_attachments() if part.get_filename()] == [
+        'att1.txt.gz',
+        'att2.txt.gz',
+        'att3.txt.gz',
+    ]
 
-        error_message, attachments = message_handlers.SendGridHandler._verify_attachments(attachments)
 
-        assert 'does not exist' in error_message
-        assert attachments == [Path(good_path)]
+def test_tar_gz_called_once_for_3_bundled_attachments(three_attachment_files, handler_mock, message_details):
 
-    def test_verify_attachments_bad_Path_input_and_Path_not_exist(self, mocker, tmp_path):
-        bad_path = tmp_path / 'b.txt'
+    message_details.attachments.extend(three_attachment_files)
+    handler_mock.email_settings['bundle_attachments'] = True
 
-        attachments = [3, bad_path]
+    test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
-        error_message, attachments = message_handlers.SendGridHandler._verify_attachments(attachments)
+    handler_mock._build_tar_gz_attachment.assert_called_once_with(
+        three_attachment_files, compresslevel=message_handlers.GZIP_COMPRESS_LEVEL
+    )
+    assert not handler_mock._build_gzip_attachment.called
 
-        assert 'does not exist' in error_message
-        assert 'Cannot get Path() of attachment' in error_message
-        assert attachments == []
 
+def test_gzip_level_setting_passed_to_gzip(three_attachment_files, handler_mock, message_details):
 
-class TestSendGridHandlerWhole:
+    message_details.attachments = three_attachment_files[:1]
+    handler_mock._gzip_level = 2
 
-    def test_send_message_blank_to_addr(self, mocker):
+    message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
-        sendgrid_settings = {
-            'from_address': 'foo@bar.com',
-            'to_addresses': '',
-            'api_key': 'its_a_secret',
-        }
-        recipient_mock = mocker.patch.object(message_handlers.SendGridHandler, '_build_recipient_addresses')
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings)
+    handler_mock._build_gzip_attachment.assert_called_once_with(three_attachment_files[0], compresslevel=2, cache=True)
 
-        message_details = models.MessageDetails()
 
-        with pytest.warns(UserWarning, match='To/From address settings exist but are empty. No emails sent.'):
-            sendgrid_handler.send_message(message_details)
-            recipient_mock.assert_not_called()
+def test_cache_gzips_setting_passed_to_gzip(three_attachment_files, handler_mock, message_details):
 
-    def test_send_message_blank_from_addr(self, mocker):
+    message_details.attachments = three_attachment_files[:1]
+    handler_mock.email_settings = {**handler_mock.email_settings, 'cache_gzips': False}
 
-        sendgrid_settings = {
-            'from_address': '',
-            'to_addresses': 'foo@bar.com',
-            'api_key': 'its_a_secret',
-        }
-        recipient_mock = mocker.patch.object(message_handlers.SendGridHandler, '_build_recipient_addresses')
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings)
+    message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
-        message_details = models.MessageDetails()
+    handler_mock._build_gzip_attachment.assert_called_once_with(
+        three_attachment_files[0], compresslevel=message_handlers.GZIP_COMPRESS_LEVEL, cache=False
+    )
 
-        with pytest.warns(UserWarning, match='To/From address settings exist but are empty. No emails sent.'):
-            sendgrid_handler.send_message(message_details)
-            recipient_mock.assert_not_called()
 
-    def test_send_message_full_integration_catches_400_bad_request(self, mocker):
-        distribution_Mock = mocker.Mock()
-        distribution_Mock.version = 3.14
-        distributions = [distribution_Mock]
-        mocker.patch('pkg_resources.require', return_value=distributions)
+@pytest.mark.parametrize('level, expected_level', [(-1, 0), (6, 3)], ids=['below_range', 'above_isal_range'])
+def test_out_of_range_gzip_level_is_clamped_at_construction(monkeypatch, level, expected_level):
+    monkeypatch.setattr(message_handlers, 'GZIP_MAX_LEVEL', 3)
 
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
+    with pytest.warns(UserWarning, match=f'gzip_level {level} is outside the 0-3 range'):
+        email_handler = message_handlers.EmailHandler({**SMTP_EMAIL_SETTINGS, 'gzip_level': level}, 'testing', 0)
 
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
+    assert email_handler._gzip_level == expected_level
 
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo')
-        sendgrid_handler.sendgrid_client = mocker.Mock()
-        sendgrid_handler.sendgrid_client.client.mail.send.post.side_effect = python_http_client.BadRequestsError(
-            400, 'HTTP Error 400: Bad Request', 'body', 'header'
-        )
 
-        with pytest.warns(
-            UserWarning, match='SendGrid error 400, might be missing a required Mail component; no e-mail sent.'
-        ):
-            sendgrid_handler.send_message(message_details)
-
-    def test_send_message_full_integration_raises_400_other(self, mocker):
-        distribution_Mock = mocker.Mock()
-        distribution_Mock.version = 3.14
-        distributions = [distribution_Mock]
-        mocker.patch('pkg_resources.require', return_value=distributions)
-
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
-
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo')
-        sendgrid_handler.sendgrid_client = mocker.Mock()
-        sendgrid_handler.sendgrid_client.client.mail.send.post.side_effect = python_http_client.BadRequestsError(
-            400, 'HTTP Error 400: Unknown', 'body', 'header'
-        )
+def test_supported_gzip_level_is_kept():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        email_handler = message_handlers.EmailHandler({**SMTP_EMAIL_SETTINGS, 'gzip_level': 0}, 'testing', 0)
 
-        with pytest.raises(python_http_client.BadRequestsError, match='HTTP Error 400: Unknown'):
-            sendgrid_handler.send_message(message_details)
+    assert email_handler._gzip_level == 0
 
-    def test_send_message_full_integration_catches_401_unauthorized(self, mocker):
 
-        distribution_Mock = mocker.Mock()
-        distribution_Mock.version = 3.14
-        distributions = [distribution_Mock]
-        mocker.patch('pkg_resources.require', return_value=distributions)
+@pytest.mark.parametrize('bundle', [False, True], ids=['individual', 'bundled'])
+def test_zstd_setting_dispatches_to_zstd(monkeypatch, three_attachment_files, handler_mock, message_details, bundle):
 
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
+    monkeypatch.setattr(message_handlers, 'zstandard', object())
+    message_details.attachments.extend(three_attachment_files)
+    handler_mock.email_settings.update(compression='zstd', bundle_attachments=bundle)
 
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
+    message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo')
-        sendgrid_handler.sendgrid_client = mocker.Mock()
-        sendgrid_handler.sendgrid_client.client.mail.send.post.side_effect = python_http_client.UnauthorizedError(
-            401, 'HTTP Error 401: Unauthorized', 'body', 'header'
+    if bundle:
+        handler_mock._build_tar_zst_attachment.assert_called_once_with(
+            three_attachment_files, level=message_handlers.ZSTD_COMPRESS_LEVEL
         )
+    else:
+        assert handler_mock._build_zstd_attachment.call_count == 3
+    assert not handler_mock._build_gzip_attachment.called
+    assert not handler_mock._build_tar_gz_attachment.called
 
-        with pytest.warns(UserWarning, match='SendGrid error 401: Unauthorized. Check API key.'):
-            sendgrid_handler.send_message(message_details)
-
-    def test_send_message_full_integration_raises_401_other(self, mocker):
-        distribution_Mock = mocker.Mock()
-        distribution_Mock.version = 3.14
-        distributions = [distribution_Mock]
-        mocker.patch('pkg_resources.require', return_value=distributions)
-
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
-
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo')
-        sendgrid_handler.sendgrid_client = mocker.Mock()
-        sendgrid_handler.sendgrid_client.client.mail.send.post.side_effect = python_http_client.UnauthorizedError(
-            401, 'HTTP Error 401: Unknown', 'body', 'header'
-        )
-
-        with pytest.raises(python_http_client.UnauthorizedError, match='HTTP Error 401: Unknown'):
-            sendgrid_handler.send_message(message_details)
-
-    def test_send_message_full_integration_with_version(self, mocker):
-
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
-
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
-
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
-
-        sendgrid_handler.send_message(message_details)
-
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert request_body['content'][0]['value'] == 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14'
-        assert 'attachments' not in request_body
-
-    def test_send_message_full_integration_with_single_file_attachment(self, mocker, tmp_path):
-
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
-
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
-
-        att_path = tmp_path
-        temp_a = att_path / 'single.txt'
-        temp_a.write_text('single')
-
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-        message_details.attachments = [temp_a]
-
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
-
-        sendgrid_handler.send_message(message_details)
-
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert request_body['content'][0]['value'] == 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14'
-        assert request_body['attachments'][0]['filename'] == temp_a.with_suffix('.zip').name
-
-    def test_send_message_full_integration_with_directory_attachment(self, mocker, tmp_path):
-
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
-
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
-
-        working_dir = tmp_path
-        dir_to_be_attached = working_dir / 'zip_me'
-        dir_to_be_attached.mkdir()
-        temp_a = dir_to_be_attached / 'a.txt'
-        temp_a.write_text('a')
-        temp_b = dir_to_be_attached / 'b.txt'
-        temp_b.write_text('b')
-
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-        message_details.attachments = [dir_to_be_attached]
-
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
-
-        sendgrid_handler.send_message(message_details)
-
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert request_body['content'][0]['value'] == 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14'
-        assert request_body['attachments'][0]['filename'] == dir_to_be_attached.with_suffix('.zip').name
-
-    def test_send_message_full_integration_with_directory_and_single_file_attachments(self, mocker, tmp_path):
-
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
-
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
-
-        working_dir = tmp_path
-
-        single_file = working_dir / 'single.txt'
-        single_file.write_text('single')
-
-        dir_to_be_attached = working_dir / 'zip_me'
-        dir_to_be_attached.mkdir()
-        temp_a = dir_to_be_attached / 'a.txt'
-        temp_a.write_text('a')
-        temp_b = dir_to_be_attached / 'b.txt'
-        temp_b.write_text('b')
-
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-        message_details.attachments = [dir_to_be_attached, single_file]
-
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
-
-        sendgrid_handler.send_message(message_details)
-
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert request_body['content'][0]['value'] == 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14'
-        attachment_names = [att['filename'] for att in request_body['attachments']]
-        assert dir_to_be_attached.with_suffix('.zip').name in attachment_names
-        assert single_file.with_suffix('.zip').name in attachment_names
-
-    def test_send_message_full_integration_with_single_file_and_directory_attachments(self, mocker, tmp_path):
-
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
 
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
+def test_zstd_setting_falls_back_to_gzip_without_zstandard(
+    monkeypatch, three_attachment_files, handler_mock, message_details
+):
 
-        working_dir = tmp_path
+    monkeypatch.setattr(message_handlers, 'zstandard', None)
+    message_details.attachments.extend(three_attachment_files)
+    handler_mock.email_settings['compression'] = 'zstd'
 
-        single_file = working_dir / 'single.txt'
-        single_file.write_text('single')
+    message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
-        dir_to_be_attached = working_dir / 'zip_me'
-        dir_to_be_attached.mkdir()
-        temp_a = dir_to_be_attached / 'a.txt'
-        temp_a.write_text('a')
-        temp_b = dir_to_be_attached / 'b.txt'
-        temp_b.write_text('b')
+    assert handler_mock._build_gzip_attachment.call_count == 3
+    assert not handler_mock._build_zstd_attachment.called
 
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-        message_details.attachments = [single_file, dir_to_be_attached]
 
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
+def test_zstd_setting_without_zstandard_warns_at_construction(monkeypatch):
+    monkeypatch.setattr(message_handlers, 'zstandard', None)
 
-        sendgrid_handler.send_message(message_details)
+    with pytest.warns(UserWarning, match="compression 'zstd' needs the zstandard package"):
+        message_handlers.EmailHandler({**SMTP_EMAIL_SETTINGS, 'compression': 'zstd'}, 'testing', 0)
 
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert request_body['content'][0]['value'] == 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14'
-        attachment_names = [att['filename'] for att in request_body['attachments']]
-        assert dir_to_be_attached.with_suffix('.zip').name in attachment_names
-        assert single_file.with_suffix('.zip').name in attachment_names
 
-    def test_send_message_full_integration_with_non_existent_single_file_attachment(self, mocker, tmp_path):
+def test_zstd_setting_with_zstandard_does_not_warn(monkeypatch):
+    monkeypatch.setattr(message_handlers, 'zstandard', object())
 
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        message_handlers.EmailHandler({**SMTP_EMAIL_SETTINGS, 'compression': 'zstd'}, 'testing', 0)
 
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
 
-        bad_file = tmp_path / 'bad.txt'
+def test_compressed_attachment_not_gzipped(tmp_path, handler_mock, message_details):
 
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-        message_details.attachments = [bad_file]
+    image_path = tmp_path / 'chart.PNG'
+    image_path.write_bytes(b'not really a png')
+    message_details.attachments = [image_path]
 
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
+    message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
-        sendgrid_handler.send_message(message_details)
+    handler_mock._build_uncompressed_attachment.assert_called_once_with(image_path)
+    assert not handler_mock._build_gzip_attachment.called
 
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14' in request_body['content'][0]['value']
-        assert 'does not exist' in request_body['content'][0]['value']
-        assert 'attachments' not in request_body
 
-    def test_send_message_full_integration_with_non_path_single_file_attachment(self, mocker):
+def test_gzip_called_for_single_bundled_attachment(three_attachment_files, handler_mock, message_details):
 
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
+    message_details.attachments = three_attachment_files[:1]
+    handler_mock.email_settings['bundle_attachments'] = True
 
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
+    test_message = message_handlers.EmailHandler._build_message(handler_mock, message_details)
 
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-        message_details.attachments = [3]
+    assert handler_mock._build_gzip_attachment.call_count == 1
+    assert not handler_mock._build_tar_gz_attachment.called
 
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
 
-        sendgrid_handler.send_message(message_details)
+def test_tar_gz(three_attachment_files):
+    attachment = message_handlers.EmailHandler._build_tar_gz_attachment(three_attachment_files[:2])
 
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14' in request_body['content'][0]['value']
-        assert 'Cannot get Path() of attachment' in request_body['content'][0]['value']
-        assert 'attachments' not in request_body
+    assert attachment.get_content_type() == 'application/x-gzip'
+    assert attachment.get_content_disposition() == 'attachment'
+    assert attachment.get_filename() == 'attachments.tar.gz'
+    with tarfile.open(fileobj=io.BytesIO(attachment.get_content()), mode='r:gz') as tar:
+        assert tar.getnames() == ['att1.txt', 'att2.txt']
+        assert tar.extractfile('att2.txt').read() == b'att2'
 
-    def test_send_message_full_integration_with_good_and_bad_single_file_attachment(self, mocker, tmp_path):
 
-        sg_api_mock = mocker.patch('sendgrid.SendGridAPIClient')
+def test_zstd(three_attachment_files):
+    zstandard = pytest.importorskip('zstandard')
 
-        sendgrid_settings = {
-            'from_address': 'foo@example.com',
-            'to_addresses': 'cheddar@example.com',
-            'api_key': 'its_a_secret',
-        }
+    attachment = message_handlers.EmailHandler._build_zstd_attachment(three_attachment_files[0])
 
-        good_file = tmp_path / 'good.txt'
-        good_file.write_text('good')
+    assert attachment.get_content_type() == 'application/zstd'
+    assert attachment.get_content_disposition() == 'attachment'
+    assert attachment.get_filename() == 'att1.txt.zst'
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(attachment.get_content()) == b'att1'
 
-        message_details = models.MessageDetails()
-        message_details.message = 'This is a\nmulti-line\nmessage'
-        message_details.attachments = [good_file, 3]
 
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings, 'ProFoo', '3.14')
+def test_tar_zst(three_attachment_files):
+    zstandard = pytest.importorskip('zstandard')
 
-        sendgrid_handler.send_message(message_details)
+    attachment = message_handlers.EmailHandler._build_tar_zst_attachment(three_attachment_files[:2])
 
-        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args[1]['request_body']
-        assert request_body['from']['email'] == 'foo@example.com'
-        assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
-        assert request_body['content'][0]['type'] == 'text/plain'
-        assert 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14' in request_body['content'][0]['value']
-        assert 'Cannot get Path() of attachment' in request_body['content'][0]['value']
-        attachment_names = [att['filename'] for att in request_body['attachments']]
-        assert good_file.with_suffix('.zip').name in attachment_names
+    assert attachment.get_content_type() == 'application/zstd'
+    assert attachment.get_filename() == 'attachments.tar.zst'
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(attachment.get_content())) as reader, \
+            tarfile.open(fileobj=reader, mode='r|') as tar:
+        assert [(member.name, tar.extractfile(member).read()) for member in tar] == [
+            ('att1.txt', b'att1'),
+            ('att2.txt', b'att2'),
+        ]
 
 
-class TestSendGridHandlerAttachments:
+@pytest.mark.parametrize(
+    'filename, expected_type',
+    [('chart.png', 'image/png'), ('old.log.gz', 'application/octet-stream')],
+    ids=['typed_by_extension', 'compressed_encoding'],
+)
+def test_uncompressed_attachment(tmp_path, filename, expected_type):
+    temp_path = tmp_path / filename
+    temp_path.write_bytes(b'already compressed')
 
-    def test_process_attachments_dispatches_single_file(self, mocker, tmp_path):
-        temp_file = tmp_path / 'test.txt'
-        temp_file.write_text('test_process_attachments_single_file')
+    attachment = message_handlers.EmailHandler._build_uncompressed_attachment(temp_path)
 
-        def _build_attachment_side_effect(value):
-            return value
+    assert attachment.get_content_type() == expected_type
+    assert attachment.get_content_disposition() == 'attachment'
+    assert attachment.get_filename() == filename
+    assert attachment.get_content() == b'already compressed'
 
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock._zip_whole_directory.return_value = 'directory call'
-        sendgrid_mock._zip_single_file.return_value = 'single file call'
-        sendgrid_mock._build_attachment.side_effect = _build_attachment_side_effect
 
-        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [temp_file])
+def test_tar_gz_bundles_symlink_target_contents(tmp_path, three_attachment_files):
+    symlink_path = tmp_path / 'current.log'
+    symlink_path.symlink_to(three_attachment_files[1])
 
-        sendgrid_mock._zip_whole_directory.assert_not_called()
-        sendgrid_mock._zip_single_file.assert_called_once()
-        assert attachments == ['single file call']
+    attachment = message_handlers.EmailHandler._build_tar_gz_attachment([three_attachment_files[0], symlink_path])
 
-    def test_process_attachments_dispatches_directory(self, mocker, tmp_path):
+    with tarfile.open(fileobj=io.BytesIO(attachment.get_content()), mode='r:gz') as tar:
+        member = tar.getmember('current.log')
+        assert member.isfile()
+        assert tar.extractfile(member).read() == b'att2'
 
-        def _build_attachment_side_effect(value):
-            return value
 
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock._zip_whole_directory.return_value = 'directory call'
-        sendgrid_mock._zip_single_file.return_value = 'single file call'
-        sendgrid_mock._build_attachment.side_effect = _build_attachment_side_effect
+def test_tar_zst_bundles_symlink_target_contents(tmp_path, three_attachment_files):
+    zstandard = pytest.importorskip('zstandard')
+    symlink_path = tmp_path / 'current.log'
+    symlink_path.symlink_to(three_attachment_files[1])
 
-        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [tmp_path])
+    attachment = message_handlers.EmailHandler._build_tar_zst_attachment([three_attachment_files[0], symlink_path])
 
-        sendgrid_mock._zip_whole_directory.assert_called_once()
-        sendgrid_mock._zip_single_file.assert_not_called()
-        assert attachments == ['directory call']
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(attachment.get_content())) as reader, \
+            tarfile.open(fileobj=reader, mode='r|') as tar:
+        members = [(member.name, member.isfile(), tar.extractfile(member).read()) for member in tar]
+    assert members == [('att1.txt', True, b'att1'), ('current.log', True, b'att2')]
 
-    def test_process_attachments_dispatches_both_file_and_directory(self, mocker, tmp_path):
-        temp_file = tmp_path / 'test.txt'
-        temp_file.write_text('test_process_attachments_single_file')
 
-        def _build_attachment_side_effect(value):
-            return value
+def test_gzip(attachment_files):
+    temp_path = attachment_files / 'single.txt'
+    temp_name = temp_path.name + '.gz'
 
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock._zip_whole_directory.return_value = 'directory call'
-        sendgrid_mock._zip_single_file.return_value = 'single file call'
-        sendgrid_mock._build_attachment.side_effect = _build_attachment_side_effect
+    attachment = message_handlers.EmailHandler._build_gzip_attachment(temp_path)
 
-        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [temp_file, tmp_path])
+    assert attachment.get_content_type() == 'application/x-gzip'
+    assert attachment.get_content_disposition() == 'attachment'
+    assert attachment.get_filename() == temp_name
+    assert attachment.get_content()
 
-        sendgrid_mock._zip_whole_directory.assert_called_once()
-        sendgrid_mock._zip_single_file.assert_called_once()
-        assert attachments == ['single file call', 'directory call']
 
-    def test_process_attachments_dispatches_no_attachments(self, mocker):
-        sendgrid_mock = mocker.Mock()
-        sendgrid_mock._zip_whole_directory.return_value = 'directory call'
-        sendgrid_mock._zip_single_file.return_value = 'single file call'
+def test_gzip_output_is_deterministic(attachment_files):
+    temp_path = attachment_files / 'single.txt'
+
+    message_handlers._gzipped_files.clear()
+    first = message_handlers.EmailHandler._build_gzip_attachment(temp_path)
+    message_handlers._gzipped_files.clear()
+    second = message_handlers.EmailHandler._build_gzip_attachment(temp_path)
+
+    assert first.get_content() == second.get_content()
+
 
-        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [])
+def _write_old_file(path, data):
+    #: Files modified within GZIP_CACHE_MIN_AGE_NS aren't cached, so backdate it
+    path.write_bytes(data)
+    old_ns = time.time_ns() - 2 * message_handlers.GZIP_CACHE_MIN_AGE_NS
+    os.utime(path, ns=(old_ns, old_ns))
+
+
+def test_gzip_reuses_output_until_file_changes(mocker, tmp_path):
+    temp_path = tmp_path / 'log.txt'
+    _write_old_file(temp_path, b'first run')
+    message_handlers._gzipped_files.clear()
+    gzip_spy = mocker.spy(message_handlers, '_gzip_stream')
+
+    first = message_handlers.EmailHandler._build_gzip_attachment(temp_path)
+    second = message_handlers.EmailHandler._build_gzip_attachment(temp_path)
+    _write_old_file(temp_path, b'second run, longer')
+    third = message_handlers.EmailHandler._build_gzip_attachment(temp_path)
+
+    assert gzip_spy.call_count == 2
+    assert gzip.decompress(first.get_content()) == gzip.decompress(second.get_content()) == b'first run'
+    assert gzip.decompress(third.get_content()) == b'second run, longer'
+
+
+def test_gzip_does_not_cache_recently_modified_file(mocker, tmp_path):
+    temp_path = tmp_path / 'log.txt'
+    temp_path.write_bytes(b'still being written')
+    message_handlers._gzipped_files.clear()
+    gzip_spy = mocker.spy(message_handlers, '_gzip_stream')
+
+    message_handlers.EmailHandler._build_gzip_attachment(temp_path)
+    message_handlers.EmailHandler._build_gzip_attachment(temp_path)
+
+    assert gzip_spy.call_count == 2
+    assert message_handlers._gzipped_files == {}
+
+
+def test_gzip_cache_can_be_turned_off(mocker, tmp_path):
+    temp_path = tmp_path / 'log.txt'
+    _write_old_file(temp_path, b'first run')
+    message_handlers._gzipped_files.clear()
+    gzip_spy = mocker.spy(message_handlers, '_gzip_stream')
+
+    message_handlers.EmailHandler._build_gzip_attachment(temp_path, cache=False)
+    message_handlers.EmailHandler._build_gzip_attachment(temp_path, cache=False)
+
+    assert gzip_spy.call_count == 2
+    assert message_handlers._gzipped_files == {}
+
+
+def test_gzip_cache_drops_oldest_over_byte_limit(monkeypatch, tmp_path):
+    monkeypatch.setattr(message_handlers, 'GZIP_CACHE_MAX_BYTES', 50)
+    message_handlers._gzipped_files.clear()
+    for name in 'abc':
+        _write_old_file(tmp_path / name, name.encode() * 10)
+        message_handlers.EmailHandler._build_gzip_attachment(tmp_path / name)
+
+    cached_names = [os.path.basename(cache_key[0]) for cache_key in message_handlers._gzipped_files]
+    assert cached_names == ['b', 'c']
+
+
+def test_gzip_from_stream_requires_filename():
+    with pytest.raises(ValueError, match='filename must be given'):
+        message_handlers.EmailHandler._build_gzip_attachment(io.BytesIO(b'test text'))
+
+
+@pytest.mark.parametrize(
+    'bad_key, bad_value',
+    [
+        ('smtpServer', _MISSING),
+        ('smtpPort', _MISSING),
+        ('from_address', _MISSING),
+        ('to_addresses', _MISSING),
+        ('smtpServer', ''),
+        ('smtpPort', None),
+        ('from_address', ''),
+        ('to_addresses', ''),
+    ],
+    ids=[
+        'missing_server',
+        'missing_port',
+        'missing_from_address',
+        'missing_to_address',
+        'blank_server',
+        'blank_port',
+        'blank_from_address',
+        'blank_to_address',
+    ],
+)
+def test_send_message_catches_bad_settings(mocker, monkeypatch, bad_key, bad_value):
+
+    email_settings = dict(SMTP_EMAIL_SETTINGS)
+    if bad_value is _MISSING:
+        del email_settings[bad_key]
+    else:
+        email_settings[bad_key] = bad_value
+
+    builder_mock = mocker.Mock()
+    monkeypatch.setattr(message_handlers.EmailHandler, '_build_message', builder_mock)
+    details = mocker.Mock(spec=MessageDetails)
+
+    with warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter('always')
+        email_handler = message_handlers.EmailHandler(email_settings)
+        email_handler.send_message(details)
 
-        sendgrid_mock._zip_whole_directory.assert_not_called()
-        sendgrid_mock._zip_single_file.assert_not_called()
-        assert attachments == []
+    assert [warning.category for warning in caught_warnings] == [UserWarning]
+    builder_mock.assert_not_called()
 
-    def test_process_attachments_zips_both_directory_and_single_file(self, mocker, tmp_path):
-        working_dir = tmp_path
-        dir_to_be_zipped = working_dir / 'zip_me'
-        dir_to_be_zipped.mkdir()
-        temp_a = dir_to_be_zipped / 'a.txt'
-        temp_a.write_text('a')
-        temp_b = dir_to_be_zipped / 'b.txt'
-        temp_b.write_text('b')
 
-        single_file_to_be_zipped = working_dir / 'single.txt'
-        single_file_to_be_zipped.write_text('single file')
+def test_send_message_warns_about_bad_settings_only_once(mocker, monkeypatch):
 
-        def _build_attachment_side_effect(self_obj, value):
-            return value
+    builder_mock = mocker.Mock()
+    monkeypatch.setattr(message_handlers.EmailHandler, '_build_message', builder_mock)
+    details = mocker.Mock(spec=MessageDetails)
 
-        attachment_mock = mocker.patch.object(
-            message_handlers.SendGridHandler, '_build_attachment', _build_attachment_side_effect
-        )
-        sendgrid_settings = {'api_key': 'its_a_secret'}
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings)
+    with warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter('always')
+        email_handler = message_handlers.EmailHandler({**SMTP_EMAIL_SETTINGS, 'smtpServer': ''})
+        email_handler.send_message(details)
+        email_handler.send_message(details)
 
-        attachments = sendgrid_handler._process_attachments([dir_to_be_zipped, single_file_to_be_zipped])
+    assert [warning.category for warning in caught_warnings] == [UserWarning]
+    builder_mock.assert_not_called()
 
-        assert len(attachments) == 2
-        att_names = [Path(f).name for f in attachments]
-        assert 'zip_me.zip' in att_names
-        assert 'single.zip' in att_names
 
-    def test_process_attachments_zips_both_single_file_and_directory(self, mocker, tmp_path):
-        working_dir = tmp_path
-        dir_to_be_zipped = working_dir / 'zip_me'
-        dir_to_be_zipped.mkdir()
-        temp_a = dir_to_be_zipped / 'a.txt'
-        temp_a.write_text('a')
-        temp_b = dir_to_be_zipped / 'b.txt'
-        temp_b.write_text('b')
+def test_send_message_sends_with_good_settings(mocker, monkeypatch):
 
-        single_file_to_be_zipped = working_dir / 'single.txt'
-        single_file_to_be_zipped.write_text('single file')
+    builder_mock = mocker.Mock()
+    monkeypatch.setattr(message_handlers.EmailHandler, '_build_message', builder_mock)
+    smtp_mock = mocker.patch('supervisor.message_handlers.SMTP')
+    details = mocker.Mock(spec=MessageDetails)
 
-        def _build_attachment_side_effect(self_obj, value):
-            return value
+    message_handlers.EmailHandler(SMTP_EMAIL_SETTINGS).send_message(details)
 
-        attachment_mock = mocker.patch.object(
-            message_handlers.SendGridHandler, '_build_attachment', _build_attachment_side_effect
-        )
-        sendgrid_settings = {'api_key': 'its_a_secret'}
-        sendgrid_handler = message_handlers.SendGridHandler(sendgrid_settings)
-
-        attachments = sendgrid_handler._process_attachments([single_file_to_be_zipped, dir_to_be_zipped])
-
-        assert len(attachments) == 2
-        att_names = [Path(f).name for f in attachments]
-        assert 'zip_me.zip' in att_names
-        assert 'single.zip' in att_names
-
-    def test_zip_whole_directory(self, mocker, tmp_path):
-        working_dir = tmp_path
-        dir_to_be_zipped = working_dir / 'zip_me'
-        dir_to_be_zipped.mkdir()
-        temp_a = dir_to_be_zipped / 'a.txt'
-        temp_a.write_text('a')
-        temp_b = dir_to_be_zipped / 'b.txt'
-        temp_b.write_text('b')
-
-        zipped_path = message_handlers.SendGridHandler._zip_whole_directory(working_dir, dir_to_be_zipped)
-        zip_name_list = zipfile.ZipFile(zipped_path).namelist()
-        assert 'zip_me/' in zip_name_list
-        assert 'zip_me/a.txt' in zip_name_list
-        assert 'zip_me/b.txt' in zip_name_list
-        # assert zipfile.ZipFile(zipped_path).namelist() == ['zip_me/', 'zip_me/a.txt', 'zip_me/b.txt']
-
-    def test_zip_single_file(self, mocker, tmp_path):
-        working_dir = tmp_path
-        temp_a = working_dir / 'a.txt'
-        temp_a.write_text('a')
-
-        with TemporaryDirectory() as temp_dir:
-            zipped_path = message_handlers.SendGridHandler._zip_single_file(temp_dir, temp_a)
-
-            assert zipfile.ZipFile(zipped_path).namelist() == ['a.txt']
-
-    def test_build_attachment_mock_file(self, mocker):
-        mock_open = mock.mock_open(read_data=b'test data')
-
-        with mock.patch('builtins.open', mock_open):
-            attachment = message_handlers.SendGridHandler._build_attachment('foo')
-
-            assert attachment.file_name.get() == 'foo'
-            assert attachment.file_type.get() == 'application/zip'
-            assert attachment.file_content.get() == base64.b64encode(b'test data').decode()
-
-    def test_build_attachment_single_file(self, mocker, tmp_path):
-        working_dir = tmp_path
-        temp_a = working_dir / 'a.txt'
-        temp_a.write_text('a')
-
-        with TemporaryDirectory() as temp_dir:
-            single_zip_path = message_handlers.SendGridHandler._zip_single_file(temp_dir, temp_a)
-
-            with open(single_zip_path, 'rb') as single_zip_file:
-                data = single_zip_file.read()
-            encoded = b64encode(data).decode()
-
-            attachment = message_handlers.SendGridHandler._build_attachment(single_zip_path)
-
-            assert attachment.file_name.get() == 'a.zip'
-            assert attachment.file_type.get() == 'application/zip'
-            assert attachment.file_content.get() == encoded
-
-    def test_build_attachment_directory(self, mocker, tmp_path):
-        working_dir = tmp_path
-        dir_to_be_zipped = working_dir / 'zip_me'
-        dir_to_be_zipped.mkdir()
-        temp_a = dir_to_be_zipped / 'a.txt'
-        temp_a.write_text('a')
-        temp_b = dir_to_be_zipped / 'b.txt'
-        temp_b.write_text('b')
-
-        dir_zip_path = message_handlers.SendGridHandler._zip_whole_directory(working_dir, dir_to_be_zipped)
-
-        with open(dir_zip_path, 'rb') as dir_zip_file:
-            data = dir_zip_file.read()
-        encoded = b64encode(data).decode()
-
-        attachment = message_handlers.SendGridHandler._build_attachment(dir_zip_path)
-
-        assert attachment.file_name.get() == 'zip_me.zip'
-        assert attachment.file_type.get() == 'application/zip'
-        assert attachment.file_content.get() == encoded
+    smtp_mock.assert_called_once_with('foo.example', 25)
+    smtp_mock.return_value.__enter__.return_value.sendmail.assert_called_once_with(
+        'foo@bar', 'baz@bar', builder_mock.return_value.as_string.return_value
+    )
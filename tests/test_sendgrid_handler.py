@@ -0,0 +1,560 @@
+import io
+import os
+import re
+import zipfile
+from base64 import b64encode
+from contextlib import nullcontext
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import pytest
+import python_http_client
+
+from supervisor import message_handlers
+
+#: The zip and tmp_path tests are I/O bound; with `pytest -n auto --dist loadgroup` they share a worker
+pytestmark = pytest.mark.xdist_group('sendgrid_io')
+
+#: Compiled once and escaped so the periods only match literal periods
+_EMPTY_ADDRESS_WARNING = re.compile(re.escape('To/From address settings exist but are empty. No emails sent.'))
+_MISSING_ADDRESS_WARNING = re.compile(re.escape('To/From address settings do not exist. No emails sent.'))
+
+
+@pytest.fixture
+def store_instead_of_deflate(monkeypatch):
+    #: The tests never check compression, so skip zlib
+    monkeypatch.setattr(message_handlers, 'ZIP_DEFLATED', zipfile.ZIP_STORED)
+
+
+@pytest.fixture(autouse=True)
+def empty_zipped_directory_cache():
+    #: Several tests zip the same session-scoped directory, sometimes with _build_attachment stubbed out
+    message_handlers._zipped_directories.clear()
+
+
+@pytest.fixture(scope='module')
+def mock_file_open_template():
+    file_open = mock.mock_open(read_data=b'test data')
+    #: Like an in-memory stream, the mocked file has no descriptor to memory-map
+    file_open.return_value.fileno.side_effect = io.UnsupportedOperation
+
+    return file_open
+
+
+@pytest.fixture
+def mock_file_open(mock_file_open_template):
+    #: Resetting is cheaper than rebuilding mock_open's tree of child mocks; read_data rewinds on every open()
+    mock_file_open_template.reset_mock()
+
+    return mock_file_open_template
+
+
+def _identity(value):
+    return value
+
+
+def _assert_sendgrid_body(request_body, expected_errors=(), expected_names=()):
+    """Check the request body the shared sendgrid_handler posts for a 'This is a\nmulti-line\nmessage' message"""
+
+    expected_content = 'This is a\nmulti-line\nmessage\n\nProFoo version: 3.14'
+    content = request_body['content'][0]
+
+    assert request_body['from']['email'] == 'foo@example.com'
+    assert request_body['personalizations'][0]['to'][0]['email'] == 'cheddar@example.com'
+    assert content['type'] == 'text/plain'
+    if expected_errors:
+        #: Attachment warnings are prepended to the message
+        assert content['value'].endswith(expected_content)
+        for expected_error in expected_errors:
+            assert expected_error in content['value']
+    else:
+        assert content['value'] == expected_content
+    assert sorted(attachment['filename'] for attachment in request_body.get('attachments', [])) == list(expected_names)
+
+
+class TestSendGridHandlerParts:
+
+    @pytest.fixture(scope='class')
+    def sendgrid_mock(self, class_mocker):
+        return class_mocker.Mock(spec=message_handlers.SendGridHandler)
+
+    @pytest.mark.parametrize(
+        'sendgrid_settings, warning_match, expected_addresses',
+        [
+            (
+                {
+                    'from_address': 'foo@bar.com',
+                    'to_addresses': 'cheddar@baz.com'
+                },
+                None,
+                ('foo@bar.com', 'cheddar@baz.com'),
+            ),
+            ({
+                'from_address': 'foo@bar.com'
+            }, _MISSING_ADDRESS_WARNING, (None, None)),
+            ({
+                'to_addresses': 'foo@bar.com'
+            }, _MISSING_ADDRESS_WARNING, (None, None)),
+            (
+                {
+                    'from_address': '',
+                    'to_addresses': 'foo@bar.com'
+                },
+                _EMPTY_ADDRESS_WARNING,
+                (None, None),
+            ),
+            (
+                {
+                    'from_address': 'foo@bar.com',
+                    'to_addresses': ''
+                },
+                _EMPTY_ADDRESS_WARNING,
+                (None, None),
+            ),
+        ],
+        ids=['normal', 'no_to_address', 'no_from_address', 'empty_from_address', 'empty_to_address'],
+    )
+    def test_verify_addresses(self, sendgrid_mock, sendgrid_settings, warning_match, expected_addresses):
+        sendgrid_mock.sendgrid_settings = sendgrid_settings
+        expectation = pytest.warns(UserWarning, match=warning_match) if warning_match else nullcontext()
+
+        with expectation:
+            addresses = message_handlers.SendGridHandler._verify_addresses(sendgrid_mock)
+
+        assert addresses == expected_addresses
+
+    def test_build_recipient_addresses_one_addr(self):
+        to_addr = 'foo@bar.com'
+        recipient_list = message_handlers.SendGridHandler._build_recipient_addresses(to_addr)
+        assert len(recipient_list) == 1
+        assert recipient_list[0].email == 'foo@bar.com'
+
+    def test_build_recipient_addresses_multiple_addresses(self):
+        to_addr = ['foo@bar.com', 'cheddar@baz.com']
+        recipient_list = message_handlers.SendGridHandler._build_recipient_addresses(to_addr)
+        assert len(recipient_list) == 2
+        assert recipient_list[0].email == 'foo@bar.com'
+        assert recipient_list[1].email == 'cheddar@baz.com'
+
+    def test_build_subject_no_prefix(self, mocker, make_message_details):
+        sendgrid_mock = mocker.Mock(spec=message_handlers.SendGridHandler)
+        sendgrid_mock.sendgrid_settings = {}
+        message_details = make_message_details(subject='Foo Subject')
+        subject = message_handlers.SendGridHandler._build_subject(sendgrid_mock, message_details)
+        assert subject == 'Foo Subject'
+
+    def test_build_subject_add_prefix(self, mocker, make_message_details):
+        sendgrid_mock = mocker.Mock(spec=message_handlers.SendGridHandler)
+        sendgrid_mock.sendgrid_settings = {}
+        sendgrid_mock.sendgrid_settings['prefix'] = 'Bar Prefix—'
+        message_details = make_message_details(subject='Foo Subject')
+        subject = message_handlers.SendGridHandler._build_subject(sendgrid_mock, message_details)
+        assert subject == 'Bar Prefix—Foo Subject'
+
+    def test_build_content_with_version(self, make_message_details):
+
+        message_details = make_message_details('This is a\nmessage with newlines')
+        client_name = 'ProFoo'
+        client_version = 0
+
+        content_object = message_handlers.SendGridHandler._build_content(
+            message_details.message, client_name, client_version
+        )
+        assert content_object.content == 'This is a\nmessage with newlines\n\nProFoo version: 0'
+        assert content_object.mime_type == 'text/plain'
+
+    @pytest.mark.parametrize(
+        'attachment_keys, expected_errors, expected_keys',
+        [
+            (['int'], ['Cannot get Path() of attachment'], []),
+            (['missing'], ['does not exist'], []),
+            (['good'], [], ['good']),
+            (['good', 'int'], ['Cannot get Path() of attachment'], ['good']),
+            (['good', 'missing'], ['does not exist'], ['good']),
+            (['int', 'missing'], ['does not exist', 'Cannot get Path() of attachment'], []),
+        ],
+        ids=[
+            'bad_Path_input',
+            'Path_does_not_exist',
+            'good_Path',
+            'good_Path_and_bad_Path_input',
+            'good_Path_and_Path_not_exist',
+            'bad_Path_input_and_Path_not_exist',
+        ],
+    )
+    def test_verify_attachments(self, attachment_files, attachment_keys, expected_errors, expected_keys):
+        inputs = {
+            'good': attachment_files / 'single.txt',
+            'missing': attachment_files / 'bad.txt',
+            'int': 3,
+        }
+
+        error_message, attachments = message_handlers.SendGridHandler._verify_attachments([
+            inputs[key] for key in attachment_keys
+        ])
+
+        if not expected_errors:
+            assert error_message == ''
+        for expected_error in expected_errors:
+            assert expected_error in error_message
+        assert attachments == [inputs[key] for key in expected_keys]
+
+
+@pytest.mark.slow
+@pytest.mark.usefixtures('store_instead_of_deflate')
+class TestSendGridHandlerWhole:
+
+    @pytest.fixture
+    def multiline_details(self, make_message_details):
+        #: A fresh instance each time; a copy of a shared one would share (and extend) its attachments list
+        return make_message_details('This is a\nmulti-line\nmessage')
+
+    @pytest.mark.parametrize('blank_setting', ['from_address', 'to_addresses'])
+    def test_send_message_blank_address(self, monkeypatch, sendgrid_handler, make_message_details, blank_setting):
+
+        sendgrid_handler.sendgrid_settings = {**sendgrid_handler.sendgrid_settings, blank_setting: ''}
+        recipient_mock = mock.Mock()
+        monkeypatch.setattr(sendgrid_handler, '_build_recipient_addresses', recipient_mock)
+
+        with pytest.warns(UserWarning, match=_EMPTY_ADDRESS_WARNING):
+            sendgrid_handler.send_message(make_message_details())
+
+        recipient_mock.assert_not_called()
+        sendgrid_handler.sendgrid_client.client.mail.send.post.assert_not_called()
+
+    @pytest.mark.parametrize(
+        'error, expectation',
+        [
+            (
+                python_http_client.BadRequestsError(400, 'HTTP Error 400: Bad Request', 'body', 'header'),
+                pytest.warns(
+                    UserWarning,
+                    match='SendGrid error 400, might be missing a required Mail component; no e-mail sent.'
+                ),
+            ),
+            (
+                python_http_client.BadRequestsError(400, 'HTTP Error 400: Unknown', 'body', 'header'),
+                pytest.raises(python_http_client.BadRequestsError, match='HTTP Error 400: Unknown'),
+            ),
+            (
+                python_http_client.UnauthorizedError(401, 'HTTP Error 401: Unauthorized', 'body', 'header'),
+                pytest.warns(UserWarning, match='SendGrid error 401: Unauthorized. Check API key.'),
+            ),
+            (
+                python_http_client.UnauthorizedError(401, 'HTTP Error 401: Unknown', 'body', 'header'),
+                pytest.raises(python_http_client.UnauthorizedError, match='HTTP Error 401: Unknown'),
+            ),
+        ],
+        ids=['catches_400_bad_request', 'raises_400_other', 'catches_401_unauthorized', 'raises_401_other'],
+    )
+    def test_send_message_full_integration_http_errors(self, sendgrid_handler, multiline_details, error, expectation):
+
+        sendgrid_handler.sendgrid_client.client.mail.send.post.side_effect = error
+
+        with expectation:
+            sendgrid_handler.send_message(multiline_details)
+
+    def test_send_message_full_integration_with_version(self, sendgrid_handler, multiline_details):
+
+        sendgrid_handler.send_message(multiline_details)
+
+        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args.kwargs['request_body']
+        _assert_sendgrid_body(request_body)
+
+    def test_send_message_full_integration_sends_one_request_for_all_recipients(
+        self, sendgrid_handler, multiline_details, attachment_files
+    ):
+        to_addresses = ['cheddar@example.com', 'gouda@example.com', 'brie@example.com']
+        sendgrid_handler.sendgrid_settings = {**sendgrid_handler.sendgrid_settings, 'to_addresses': to_addresses}
+        multiline_details.attachments = [attachment_files / 'single.txt']
+
+        sendgrid_handler.send_message(multiline_details)
+
+        post_mock = sendgrid_handler.sendgrid_client.client.mail.send.post
+        post_mock.assert_called_once()
+        request_body = post_mock.call_args.kwargs['request_body']
+        assert len(request_body['personalizations']) == 1
+        assert [to['email'] for to in request_body['personalizations'][0]['to']] == to_addresses
+        assert [attachment['filename'] for attachment in request_body['attachments']] == ['single.zip']
+
+    @pytest.mark.parametrize(
+        'attachment_keys, expected_errors, expected_names',
+        [
+            (['good'], [], ['single.zip']),
+            (['dir'], [], ['zip_me.zip']),
+            (['dir', 'good'], [], ['single.zip', 'zip_me.zip']),
+            (['good', 'dir'], [], ['single.zip', 'zip_me.zip']),
+            (['missing'], ['does not exist'], []),
+            (['int'], ['Cannot get Path() of attachment'], []),
+            (['good', 'int'], ['Cannot get Path() of attachment'], ['single.zip']),
+        ],
+        ids=[
+            'single_file',
+            'directory',
+            'directory_and_single_file',
+            'single_file_and_directory',
+            'non_existent_single_file',
+            'non_path_single_file',
+            'good_and_bad_single_file',
+        ],
+    )
+    def test_send_message_full_integration_with_attachments(
+        self, sendgrid_handler, multiline_details, attachment_files, attachment_keys, expected_errors, expected_names
+    ):
+        inputs = {
+            'good': attachment_files / 'single.txt',
+            'dir': attachment_files / 'zip_me',
+            'missing': attachment_files / 'bad.txt',
+            'int': 3,
+        }
+
+        multiline_details.attachments = [inputs[key] for key in attachment_keys]
+
+        sendgrid_handler.send_message(multiline_details)
+
+        request_body = sendgrid_handler.sendgrid_client.client.mail.send.post.call_args.kwargs['request_body']
+        _assert_sendgrid_body(request_body, expected_errors, expected_names)
+
+
+class TestSendGridHandlerAttachments:
+
+    @pytest.fixture
+    def sendgrid_mock(self, mocker):
+        sendgrid_mock = mocker.Mock(spec=message_handlers.SendGridHandler)
+        #: The stubbed zip paths don't exist, so there is nothing to measure for the cache
+        sendgrid_mock.sendgrid_settings = {'cache_zips': False}
+        sendgrid_mock._zip_whole_directory.return_value = 'directory call'
+        sendgrid_mock._zip_single_file.return_value = 'single file call'
+        sendgrid_mock._build_attachment.side_effect = _identity
+
+        return sendgrid_mock
+
+    def test_process_attachments_dispatches_single_file(self, sendgrid_mock, tmp_path):
+        temp_file = tmp_path / 'test.txt'
+        temp_file.touch()
+
+        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [temp_file])
+
+        sendgrid_mock._zip_whole_directory.assert_not_called()
+        sendgrid_mock._zip_single_file.assert_called_once()
+        assert attachments == ['single file call']
+
+    def test_process_attachments_dispatches_directory(self, sendgrid_mock, tmp_path):
+        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [tmp_path])
+
+        sendgrid_mock._zip_whole_directory.assert_called_once()
+        sendgrid_mock._zip_single_file.assert_not_called()
+        assert attachments == ['directory call']
+
+    def test_process_attachments_dispatches_both_file_and_directory(self, sendgrid_mock, tmp_path):
+        temp_file = tmp_path / 'test.txt'
+        temp_file.touch()
+
+        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [temp_file, tmp_path])
+
+        sendgrid_mock._zip_whole_directory.assert_called_once()
+        sendgrid_mock._zip_single_file.assert_called_once()
+        assert attachments == ['single file call', 'directory call']
+
+    def test_process_attachments_reuses_unchanged_directory(self, sendgrid_mock, tmp_path):
+        log_dir = tmp_path / 'logs'
+        log_dir.mkdir()
+        (log_dir / 'log.txt').write_text('first')
+        zip_path = tmp_path / 'logs.zip'
+        zip_path.write_bytes(b'zip')
+        sendgrid_mock.sendgrid_settings = {}
+        sendgrid_mock._zip_whole_directory.return_value = zip_path
+
+        first = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [log_dir])
+        second = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [log_dir])
+        #: Change both the size and the mtime so the change is seen regardless of the filesystem's mtime resolution
+        (log_dir / 'log.txt').write_text('second, longer')
+        modified_ns = (log_dir / 'log.txt').stat().st_mtime_ns + 10**9
+        os.utime(log_dir / 'log.txt', ns=(modified_ns, modified_ns))
+        message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [log_dir])
+
+        assert first == second == [zip_path]
+        assert sendgrid_mock._zip_whole_directory.call_count == 2
+
+    def test_process_attachments_skips_cache_when_disabled(self, sendgrid_mock, tmp_path):
+        message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [tmp_path])
+        message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [tmp_path])
+
+        assert sendgrid_mock._zip_whole_directory.call_count == 2
+        assert message_handlers._zipped_directories == {}
+
+    def test_zipped_directory_cache_drops_oldest(self, monkeypatch):
+        monkeypatch.setattr(message_handlers, 'ZIP_CACHE_SIZE', 2)
+
+        for key in 'abc':
+            message_handlers._remember_zipped_directory(key, key.upper(), 1)
+
+        assert message_handlers._zipped_directories == {'b': ('B', 1), 'c': ('C', 1)}
+
+    def test_zipped_directory_cache_drops_oldest_over_byte_limit(self, monkeypatch):
+        monkeypatch.setattr(message_handlers, 'ZIP_CACHE_MAX_BYTES', 10)
+
+        for key, size in zip('abc', (4, 4, 5)):
+            message_handlers._remember_zipped_directory(key, key.upper(), size)
+
+        assert message_handlers._zipped_directories == {'b': ('B', 4), 'c': ('C', 5)}
+
+    def test_zipped_directory_cache_skips_attachments_over_byte_limit(self, monkeypatch):
+        monkeypatch.setattr(message_handlers, 'ZIP_CACHE_MAX_BYTES', 10)
+        message_handlers._remember_zipped_directory('a', 'A', 4)
+
+        attachment = message_handlers._remember_zipped_directory('b', 'B', 11)
+
+        assert attachment == 'B'
+        assert message_handlers._zipped_directories == {'a': ('A', 4)}
+
+    def test_process_attachments_dispatches_no_attachments(self, sendgrid_mock):
+        attachments = message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [])
+
+        sendgrid_mock._zip_whole_directory.assert_not_called()
+        sendgrid_mock._zip_single_file.assert_not_called()
+        assert attachments == []
+
+    @pytest.mark.usefixtures('store_instead_of_deflate')
+    def test_process_attachments_zips_both_directory_and_single_file(
+        self, monkeypatch, attachment_files, sendgrid_handler
+    ):
+        dir_to_be_zipped = attachment_files / 'zip_me'
+        single_file_to_be_zipped = attachment_files / 'single.txt'
+
+        monkeypatch.setattr(sendgrid_handler, '_build_attachment', _identity)
+        attachments = sendgrid_handler._process_attachments([dir_to_be_zipped, single_file_to_be_zipped])
+
+        assert len(attachments) == 2
+        assert frozenset(os.path.basename(f) for f in attachments) == {'zip_me.zip', 'single.zip'}
+
+    @pytest.mark.usefixtures('store_instead_of_deflate')
+    def test_process_attachments_zips_both_single_file_and_directory(
+        self, monkeypatch, attachment_files, sendgrid_handler
+    ):
+        dir_to_be_zipped = attachment_files / 'zip_me'
+        single_file_to_be_zipped = attachment_files / 'single.txt'
+
+        monkeypatch.setattr(sendgrid_handler, '_build_attachment', _identity)
+        attachments = sendgrid_handler._process_attachments([single_file_to_be_zipped, dir_to_be_zipped])
+
+        assert len(attachments) == 2
+        assert frozenset(os.path.basename(f) for f in attachments) == {'zip_me.zip', 'single.zip'}
+
+    @pytest.mark.usefixtures('store_instead_of_deflate')
+    def test_process_attachments_zips_same_named_attachments(self, monkeypatch, tmp_path, sendgrid_handler):
+        attachments = []
+        for parent in 'ab':
+            log_dir = tmp_path / parent / 'logs'
+            log_dir.mkdir(parents=True)
+            (log_dir / 'x.log').write_text(parent)
+            attachments.extend([log_dir, log_dir / 'x.log'])
+
+        monkeypatch.setattr(sendgrid_handler, '_build_attachment', _identity)
+        zip_paths = sendgrid_handler._process_attachments(attachments)
+
+        assert [os.path.basename(f) for f in zip_paths] == ['logs.zip', 'x.zip', 'logs.zip', 'x.zip']
+        assert len(set(zip_paths)) == 4
+
+    def test_zip_whole_directory(self, prebuilt_zip_dir):
+        assert prebuilt_zip_dir.names == ('zip_me/', 'zip_me/a.txt', 'zip_me/b.txt')
+
+    def test_zip_whole_directory_stores_compressed_suffixes(self, tmp_path):
+        dir_to_be_zipped = tmp_path / 'zip_me'
+        dir_to_be_zipped.mkdir()
+        (dir_to_be_zipped / 'a.txt').write_bytes(b'a')
+        (dir_to_be_zipped / 'b.PNG').write_bytes(b'b')
+
+        zipped_path = message_handlers.SendGridHandler._zip_whole_directory(tmp_path, dir_to_be_zipped)
+
+        with zipfile.ZipFile(zipped_path) as zipped:
+            compress_types = {info.filename: info.compress_type for info in zipped.infolist()}
+        assert compress_types['zip_me/a.txt'] == zipfile.ZIP_DEFLATED
+        assert compress_types['zip_me/b.PNG'] == zipfile.ZIP_STORED
+
+    def test_process_attachments_passes_zip_settings(self, sendgrid_mock, tmp_path):
+        temp_file = tmp_path / 'test.txt'
+        temp_file.touch()
+        sendgrid_mock.sendgrid_settings = {
+            'zip_compresslevel': 9,
+            'zip_store_extensions': ['.LOG'],
+            'cache_zips': False
+        }
+
+        message_handlers.SendGridHandler._process_attachments(sendgrid_mock, [temp_file, tmp_path])
+
+        sendgrid_mock._zip_single_file.assert_called_once_with(mock.ANY, temp_file, 9, frozenset({'.log'}))
+        sendgrid_mock._zip_whole_directory.assert_called_once_with(mock.ANY, tmp_path, 9, frozenset({'.log'}))
+
+    def test_zip_single_file(self, mocker):
+        #: Only the control flow is under test, so skip zlib and the disk entirely
+        zipfile_mock = mocker.patch('supervisor.message_handlers.ZipFile')
+        attachment_path = Path('foo', 'a.txt')
+
+        zipped_path = message_handlers.SendGridHandler._zip_single_file('working_dir', attachment_path)
+
+        assert zipped_path == Path('working_dir', 'a.zip')
+        zipfile_mock.assert_called_once_with(
+            zipped_path, 'x', compression=zipfile.ZIP_DEFLATED, compresslevel=message_handlers.ZIP_COMPRESS_LEVEL
+        )
+        zipfile_mock.return_value.__enter__.return_value.write.assert_called_once_with(attachment_path, 'a.txt')
+
+    def test_zip_single_file_stores_compressed_suffixes(self, mocker):
+        zipfile_mock = mocker.patch('supervisor.message_handlers.ZipFile')
+
+        zipped_path = message_handlers.SendGridHandler._zip_single_file('working_dir', Path('foo', 'a.PNG'))
+
+        zipfile_mock.assert_called_once_with(
+            zipped_path, 'x', compression=zipfile.ZIP_STORED, compresslevel=message_handlers.ZIP_COMPRESS_LEVEL
+        )
+
+    def test_build_attachment_mock_file(self, mock_file_open):
+        with mock.patch('builtins.open', mock_file_open):
+            attachment = message_handlers.SendGridHandler._build_attachment('foo')
+
+            assert attachment.file_name.get() == 'foo'
+            assert attachment.file_type.get() == 'application/zip'
+            assert attachment.file_content.get() == b64encode(b'test data').decode()
+
+    @pytest.mark.usefixtures('store_instead_of_deflate')
+    def test_build_attachment_single_file(self, tmp_path):
+        working_dir = tmp_path
+        temp_a = working_dir / 'a.txt'
+        temp_a.write_bytes(b'a')
+
+        with TemporaryDirectory() as temp_dir:
+            single_zip_path = message_handlers.SendGridHandler._zip_single_file(temp_dir, temp_a)
+
+            encoded = b64encode(Path(single_zip_path).read_bytes()).decode()
+
+            attachment = message_handlers.SendGridHandler._build_attachment(single_zip_path)
+
+            assert attachment.file_name.get() == 'a.zip'
+            assert attachment.file_type.get() == 'application/zip'
+            assert attachment.file_content.get() == encoded
+
+    def test_build_attachment_chunks_match_whole_file_encoding(self, monkeypatch, prebuilt_zip_dir):
+        monkeypatch.setattr(message_handlers, 'B64_CHUNK_SIZE', 3)
+
+        attachment = message_handlers.SendGridHandler._build_attachment(prebuilt_zip_dir.zip_path)
+
+        assert attachment.file_content.get() == prebuilt_zip_dir.b64
+
+    def test_build_attachment_mapped_chunks_match_whole_file_encoding(self, monkeypatch, prebuilt_zip_dir):
+        monkeypatch.setattr(message_handlers, 'B64_CHUNK_SIZE', 3)
+        monkeypatch.setattr(message_handlers, 'MMAP_MIN_SIZE', 1)
+        mmap_spy = mock.Mock(wraps=message_handlers.mmap.mmap)
+        monkeypatch.setattr(message_handlers.mmap, 'mmap', mmap_spy)
+
+        attachment = message_handlers.SendGridHandler._build_attachment(prebuilt_zip_dir.zip_path)
+
+        assert mmap_spy.call_count == 1
+        assert attachment.file_content.get() == prebuilt_zip_dir.b64
+
+    def test_build_attachment_directory(self, prebuilt_zip_dir):
+        attachment = message_handlers.SendGridHandler._build_attachment(prebuilt_zip_dir.zip_path)
+
+        assert attachment.file_name.get() == 'zip_me.zip'
+        assert attachment.file_type.get() == 'application/zip'
+        assert attachment.file_content.get() == prebuilt_zip_dir.b64